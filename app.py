@@ -7,32 +7,226 @@ app: Module to run the app
 """
 import dash
 import dash_core_components as dcc
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State, ClientsideFunction
 import dash_html_components as html
-from flask import send_file
+import dash_table
+from flask import Response, request, jsonify, stream_with_context
 
+import json
+import threading
 from sys import exit
 from datetime import date
+from urllib.parse import urlencode
+from functools import lru_cache
 import pandas as pd
 
-from src.mysettings import months_list, firsts_of_the_month
-from src.helpers import regions_of_country, regionError, adaptMetricsInterval
+from src.mysettings import months_list, firsts_of_the_month, PREPROCESSED_DATA_PATH, PREPROCESSED_CSV_PATH, SERVED_COUNTRIES
+from src.mysettings import PREPROCESSED_SERIES_PATH, PREPROCESSED_VERSION_PATH, TREND_CACHE_SIZE, FIGURE_CACHE_SIZE
+from src.mysettings import TABLE_PAGE_SIZE, table_columns, DOWNSAMPLE_SERIES, region_corrections
+from src.helpers import regions_of_country, regionError, adaptMetricsInterval, latest_value_index, table_page
+from src.helpers import date_range_index
 from src.preprocess import label_gender
+from src.storage import read_store, read_series, store_version
+from src.cache import LRUCache
+from src.export import EXPORT_FORMATS, export_batches, export_chunks
 import src.plots as plt 
 
 ##########################################
 # Import needed data
 
+# Only the series table (countries, regions and labels of the series) is loaded at start,
+# the partitions (Country, Metric) needed by a graph are read when it is plotted
+
 print('Computed data importation : ')
+if PREPROCESSED_DATA_PATH.exists():
+    STORE_PATH = PREPROCESSED_DATA_PATH
+else:
+    STORE_PATH = PREPROCESSED_CSV_PATH
+
+def load_series():
+    """Loads the series table, and the countries and regions served by the app
+
+    Returns:
+    --------
+    df_series : Pandas DataFrame
+        the series table (None if the dataset has none, see src.storage.read_series)
+
+    df_regions : Pandas DataFrame
+        the served countries and their regions
+
+    countries_list : str list
+        the served countries
+    """
+    df_series = read_series(PREPROCESSED_SERIES_PATH)
+
+    if df_series is None:
+        df_regions = read_store(
+                                STORE_PATH, 
+                                countries = SERVED_COUNTRIES, 
+                                columns = ['Country', 'Region']
+                                )
+    else:
+        # the series table holds the original regions, the dataset the corrected ones
+        df_regions = df_series[['Country', 'Region']].replace({'Region' : region_corrections})
+
+        if SERVED_COUNTRIES is not None:
+            df_regions = df_regions[df_regions['Country'].isin(SERVED_COUNTRIES)]
+
+    df_regions = df_regions[df_regions['Country'] != 'UK'].drop_duplicates()
+
+    countries_list = sorted(
+                            list(
+                                set(
+                                    df_regions['Country']
+                                    )
+                                )
+                            )
+
+    return df_series, df_regions, countries_list
+
 try:
-    df = pd.read_csv('data/preprocessed_data.csv')
-    df = df[df['Country'] != 'UK']
+    df_series, df_regions, countries_list = load_series()
 except:
     print('data not found, please preprocess data before launching the app')
     exit()
 
 print('Done')
 
+@lru_cache(maxsize = 32)
+def load_data(countries, metrics):
+    """Loads the preprocessed data of some countries and metrics
+
+    Parameters:
+    -----------
+    countries : str tuple
+        the countries to load (None for all the served countries)
+
+    metrics : str tuple
+        the metrics to load
+
+    Returns:
+    --------
+    df : Pandas DataFrame
+        the corresponding data (shared between callbacks, not to be modified)
+    """
+    if countries is None:
+        countries = countries_list
+    else:
+        countries = [country for country in countries if country in countries_list]
+
+    df = read_store(STORE_PATH, countries = countries, metrics = list(metrics))
+
+    return df
+
+@lru_cache(maxsize = 32)
+def load_latest_values(countries, metric):
+    """Loads the latest value lookup (see latest_value_index) of the preprocessed data
+    of some countries and a metric, built once for all the dates, ages and genders of the maps
+
+    Parameters:
+    -----------
+    countries : str tuple
+        the countries to load (None for all the served countries)
+
+    metric : str
+        the metric to load
+
+    Returns:
+    --------
+    index : dict
+        the corresponding lookup (shared between callbacks, not to be modified)
+    """
+    return latest_value_index(load_data(countries, (metric,)))
+
+@lru_cache(maxsize = 32)
+def load_date_index(countries, metrics):
+    """Loads the date ranges lookup (see date_range_index) of the preprocessed data
+    of some countries and metrics, built once for all the selections and dates of the charts
+
+    Parameters:
+    -----------
+    countries : str tuple
+        the countries to load
+
+    metrics : str tuple
+        the metrics to load
+
+    Returns:
+    --------
+    index : dict
+        the corresponding lookup (shared between callbacks, not to be modified)
+    """
+    return date_range_index(load_data(countries, metrics))
+
+@lru_cache(maxsize = 8)
+def load_table(selected_graph, C, R, A, G, M, start_date, end_date, hist_end_date):
+    """Loads the rows of the data table of a chart or histogram (see normaliseSelection),
+    kept while its pages are browsed, sorted or filtered
+
+    Parameters:
+    -----------
+    selected_graph : str
+        the graph ('hist' for the histogram, 'chart' for the chart)
+
+    C, R, A, G, M : tuples
+        the countries, regions, age ranges, genders and metrics
+
+    start_date, end_date : str
+        the first and last dates of the chart
+
+    hist_end_date : int
+        the last date of the histogram
+
+    Returns:
+    --------
+    df : Pandas DataFrame
+        the rows of the table (shared between callbacks, not to be modified)
+    """
+    if selected_graph == 'hist':
+        df = plt.histogram_data(load_data((C[0],), (M[0],)), C[0], R[0], G[0], M[0], hist_end_date)
+    else:
+        df = plt.build_download_file(
+                                load_data(tuple(sorted(C)), tuple(sorted(M))), list(C), list(R), list(A), list(G), list(M), 
+                                start_date, end_date, index = load_date_index(tuple(sorted(C)), tuple(sorted(M)))
+                                )
+
+    return df[[col for col, name in table_columns]]
+
+# Fitted trend curves, by series, metric, dates, degree, forecast and unit (see src.helpers.regression)
+TREND_CACHE = LRUCache(TREND_CACHE_SIZE)
+TREND_CACHE.validate(store_version(PREPROCESSED_VERSION_PATH))
+
+# Figures (serialised JSON) by graph and normalised inputs of graph_callback, bounded by their size
+FIGURE_CACHE = LRUCache(FIGURE_CACHE_SIZE, sizeof = len)
+FIGURE_CACHE.validate(TREND_CACHE.version)
+
+# the data is reloaded by one thread of the server at a time
+DATA_LOCK = threading.Lock()
+
+def check_data_version():
+    """Empties the caches of the app if the preprocessed data has been written again
+    since they were filled : only the version file is read (see src.storage.store_version)
+    """
+    global df_series, df_regions, countries_list
+
+    version = store_version(PREPROCESSED_VERSION_PATH)
+
+    if version == TREND_CACHE.version:
+        return
+
+    with DATA_LOCK:
+        if version != TREND_CACHE.version:
+            load_data.cache_clear()
+            load_latest_values.cache_clear()
+            load_date_index.cache_clear()
+            load_table.cache_clear()
+
+            # the series table is written with the data (new series, new labels, new countries)
+            df_series, df_regions, countries_list = load_series()
+
+            TREND_CACHE.validate(version)
+            FIGURE_CACHE.validate(version)
+
 ##########################################
 # Create the hole app layout
 
@@ -94,13 +288,7 @@ app.layout = html.Div(
             dcc.Dropdown(
                 id = 'country_checklist',
                 options = [
-                    {'label' : i, 'value' : i} for i in 
-                        sorted(list(
-                                    set(
-                                        df['Country']
-                                        )
-                                    )
-                                )
+                    {'label' : i, 'value' : i} for i in countries_list
                         ],
                 value = ['France'],
                 multi = True
@@ -381,15 +569,38 @@ app.layout = html.Div(
         ), 
 
     html.Div(
-        [
+        id = 'main_graph',
+        children = [
             dcc.Graph(
                 id = 'plot', 
                 config = {'scrollZoom' : True}, 
-                    )
+                    ),
+            dcc.Store(id = 'figure_store')
         ], 
         className = 'main_graph'
             ),
 
+    html.Div(
+        id = 'main_table',
+        style = {'display': 'none'},
+        children = [
+            dash_table.DataTable(
+                id = 'data_table',
+                columns = [{'name' : name, 'id' : col} for col, name in table_columns],
+                page_current = 0,
+                page_size = TABLE_PAGE_SIZE,
+                page_action = 'custom',
+                sort_action = 'custom',
+                sort_mode = 'multi',
+                sort_by = [],
+                filter_action = 'custom',
+                filter_query = '',
+                style_header = {'backgroundColor' : 'rgba(0,131,138,0.5)'},
+                    )
+        ], 
+        className = 'main_table'
+            ),
+
     html.Div(
         id = 'select_table',
         children = [
@@ -409,7 +620,10 @@ app.layout = html.Div(
         id = 'download_button',
         style = {'display': 'block'},
         children = [
-                   dcc.Markdown('[Download data](/dash/download)')  
+                   dcc.Markdown(
+                       id = 'download_link',
+                       children = 'Download data : [CSV](/dash/download)'
+                                )
                     ],
         className = 'download_button'
         ), 
@@ -447,13 +661,131 @@ app.layout = html.Div(
                 )
 
 
+def normaliseSelection(selected_countries, selected_regions, selected_ages, 
+                        selected_metrics, selected_interval, selected_genders):
+    """Transforms the selected values of the criteria into the lists of countries, regions,
+    age ranges, metrics and genders to plot (default values for empty selections)
+
+    Parameters:
+    -----------
+    selected_countries, selected_regions : str list
+        the selected countries and regions
+
+    selected_ages : int list
+        the selected age ranges (888 for all of them)
+
+    selected_metrics : str list
+        the selected metrics
+
+    selected_interval : str
+        the time interval (Cumulative, Daily, Weekly, etc.)
+
+    selected_genders : str list
+        the selected genders
+
+    Returns:
+    --------
+    C, R, A, M, G : lists
+        the countries, regions, age ranges, metrics and genders
+    """
+    if isinstance(selected_countries, str) or isinstance(selected_countries, str):
+        C = [selected_countries]
+    else:
+        C = selected_countries
+    if selected_countries in [[], None]:
+        C = ['France']
+    else:
+        pass
+
+    if isinstance(selected_regions, str):
+        R = [selected_regions]
+    else:
+        R = selected_regions
+    if selected_regions in [[], None] or regionError(df_regions, C, R):
+        R = ['All']
+    elif 'All_regions' in selected_regions:
+        regions_list = list(regions_of_country(df_regions, C))
+        if regions_list == []:
+            R = ['All']
+        else:
+            R = regions_list
+    else:
+        pass
+
+    if  isinstance(selected_ages, int) or isinstance(selected_ages, str):
+        A = [selected_ages]
+    else:
+        A = selected_ages
+    if selected_ages in [[], None]:
+        A = [i * 10 for i in range(4, 9)]
+    elif 888 in A:
+        A = [10 * i for i in range(11)]
+    else:
+        pass
+
+    if isinstance(selected_metrics, str) or isinstance(selected_metrics, str):
+        M = [selected_metrics]
+    else:
+        M = selected_metrics
+    if selected_metrics in [[], None]:
+        M = ['Deaths']
+    else:
+        M = adaptMetricsInterval(M, selected_interval)
+
+    if isinstance(selected_genders, str) or isinstance(selected_genders, str):
+        G = [selected_genders]
+    else:
+        G = selected_genders
+    if selected_genders in [[], None]:
+        G = ['b']
+    else:
+        pass
+
+    return C, R, A, M, G
+
 @app.server.route('/dash/download') 
 def download_csv():
+    """Sends the data of the chart described by the query parameters (see download_callback),
+    read from the preprocessed dataset batch by batch and streamed chunk by chunk, in the
+    format given by the 'format' parameter (csv, csv.gz or parquet)
+    """
+    export_format = request.args.get('format', 'csv')
+
+    if export_format not in EXPORT_FORMATS:
+        return Response('unknown format : ' + export_format, status = 400, mimetype = 'text/plain')
+
+    C, R, A, M, G = normaliseSelection(
+                                    request.args.getlist('country'), 
+                                    request.args.getlist('region'), 
+                                    request.args.getlist('age', type = int), 
+                                    request.args.getlist('metric'), 
+                                    request.args.get('interval'), 
+                                    request.args.getlist('gender')
+                                    )
+    start_date = request.args.get('start_date', '2020-01-01')
+    end_date = request.args.get('end_date', date.today().isoformat())
+
+    check_data_version()
+    batches = export_batches(
+                            STORE_PATH, [country for country in C if country in countries_list], 
+                            R, A, G, M, start_date, end_date
+                            )
+
+    extension, mimetype = EXPORT_FORMATS[export_format]
+
+    return Response(
+                    stream_with_context(export_chunks(batches, export_format)),
+                    mimetype = mimetype,
+                    headers = {'Content-Disposition' : 'attachment; filename=data_download.' + extension}
+                    )
 
-    return send_file('data/download/data_download.csv',
-                     mimetype = 'text/csv',
-                     attachment_filename = 'data_download.csv',
-                     as_attachment = True)
+@app.server.route('/dash/cache')
+def cache_stats():
+    """Gives the counters of the caches of the app (hits, misses, entries and size)"""
+    return jsonify({
+                    'figures' : FIGURE_CACHE.stats(),
+                    'trends' : TREND_CACHE.stats()
+                    })
 
 @app.callback(
     [
@@ -605,26 +937,203 @@ def second_checklist_callback(selected_countries):
     else:
         pass
 
-    regions_list = regions_of_country(df, C)
+    regions_list = regions_of_country(df_regions, C)
     options = [{'label' : 'All regions', 'value' : 'All_regions'}] + [{'label' : i, 'value' : i} for i in regions_list]
 
     return options
 
 @app.callback(
-    Output('plot', 'figure'),
+    [
+    Output('main_graph', component_property = 'style'),
+    Output('main_table', component_property = 'style'),
+    ],
+    [
+    Input('table_button', 'value'),
+    Input('map_button', 'value')
+    ]
+            )
+def table_display_callback(chart_or_table, selected_graph):
+    """Displays the data table instead of the chart or the histogram
+
+    Parameters:
+    -----------
+    chart_or_table : str
+        activates the table display option
+
+    selected_graph : str
+        the graph to plot (the maps have no table)
+
+    Returns:
+    --------
+    display_option : dict list
+        the displaying options of the graph and of the table
+    """
+    if chart_or_table == 'table' and selected_graph not in ['worldmap', 'usamap']:
+        display_option = [{'display': 'none'}, {'display': 'block'}]
+    else:
+        display_option = [{'display': 'block'}, {'display': 'none'}]
+
+    return display_option
+
+@app.callback(
+    [
+    Output('data_table', 'data'),
+    Output('data_table', 'page_count'),
+    Output('data_table', 'page_current'),
+    ],
+    [
+    Input('country_checklist', 'value'), 
+    Input('region_checklist', 'value'), 
+    Input('age_checklist', 'value'), 
+    Input('metric_checklist', 'value'),
+    Input('time_scale_checklist', 'value'), 
+    Input('gender_checklist', 'value'),
+    Input('map_button', 'value'), 
+    Input('date_range', 'start_date'), 
+    Input('date_range', 'end_date'), 
+    Input('table_button', 'value'),
+    Input('date_grad_hist_slider', 'value'),
+    Input('data_table', 'page_current'),
+    Input('data_table', 'page_size'),
+    Input('data_table', 'sort_by'),
+    Input('data_table', 'filter_query')
+    ]
+            )
+def table_callback(
+    selected_countries, selected_regions, selected_ages, 
+    selected_metrics, selected_interval, selected_genders, 
+    selected_graph, start_date, end_date, chart_or_table, hist_end_date, 
+    page_current, page_size, sort_by, filter_query
+                ):
+    """Gives the displayed page of the data table : the rows are selected, filtered, sorted
+    and sliced on the server, only the page is sent to the browser
+
+    Parameters:
+    -----------
+    selected_countries, selected_regions, selected_ages, selected_metrics, 
+    selected_interval, selected_genders, selected_graph, start_date, end_date, 
+    chart_or_table, hist_end_date :
+        see graph_callback
+
+    page_current, page_size : int
+        the displayed page (from 0) and its number of rows
+
+    sort_by : dict list
+        the sorted columns and their directions
+
+    filter_query : str
+        the filters of the columns
+
+    Returns:
+    --------
+    data : dict list
+        the rows of the page
+
+    page_count : int
+        the number of pages
+
+    page_current : int
+        the displayed page : the first one when the rows change (selection, filters or sort)
+    """
+    if chart_or_table != 'table' or selected_graph in ['worldmap', 'usamap']:
+        return [], 1, 0
+
+    # only a change of page keeps the page, other inputs change the rows
+    triggers = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+
+    if 'data_table.page_current' not in triggers:
+        page_current = 0
+
+    check_data_version()
+
+    C, R, A, M, G = normaliseSelection(
+                                    selected_countries, selected_regions, selected_ages, 
+                                    selected_metrics, selected_interval, selected_genders
+                                    )
+
+    if selected_graph != 'hist':
+        hist_end_date = None
+    else:
+        start_date, end_date = None, None
+
+    df = load_table(
+                    selected_graph, tuple(C), tuple(R), tuple(A), tuple(G), tuple(M), 
+                    start_date, end_date, hist_end_date
+                    )
+
+    return table_page(df, page_current or 0, page_size or TABLE_PAGE_SIZE, sort_by, filter_query)
+
+@app.callback(
+    Output('download_link', 'children'),
+    [
+    Input('country_checklist', 'value'), 
+    Input('region_checklist', 'value'), 
+    Input('age_checklist', 'value'), 
+    Input('metric_checklist', 'value'),
+    Input('time_scale_checklist', 'value'), 
+    Input('gender_checklist', 'value'),
+    Input('date_range', 'start_date'), 
+    Input('date_range', 'end_date')
+    ]
+            )
+def download_callback(
+    selected_countries, selected_regions, selected_ages, 
+    selected_metrics, selected_interval, selected_genders, 
+    start_date, end_date
+                    ):
+    """Puts the selected criteria of the chart in the query of the download link,
+    the data being built when it is requested (see download_csv)
+
+    Parameters:
+    -----------
+    selected_countries, selected_regions, selected_ages, selected_metrics, 
+    selected_interval, selected_genders, start_date, end_date :
+        see graph_callback
+
+    Returns:
+    --------
+    links : str
+        the markdown links to the data of the chart, one by format
+    """
+    def as_list(values):
+        if values is None:
+            return []
+        elif isinstance(values, (str, int)):
+            return [values]
+        else:
+            return values
+
+    query = {
+            'country' : as_list(selected_countries),
+            'region' : as_list(selected_regions),
+            'age' : as_list(selected_ages),
+            'metric' : as_list(selected_metrics),
+            'gender' : as_list(selected_genders),
+            }
+
+    for name, value in [('interval', selected_interval), ('start_date', start_date), ('end_date', end_date)]:
+        if value is not None:
+            query[name] = value
+
+    links = [
+            '[' + export_format.upper() + '](/dash/download?' + urlencode(dict(query, format = export_format), doseq = True) + ')'
+            for export_format in EXPORT_FORMATS
+            ]
+
+    return 'Download data : ' + ' - '.join(links)
+
+@app.callback(
+    Output('figure_store', 'data'),
     [
     Input('country_checklist', 'value'), 
     Input('region_checklist', 'value'), 
     Input('age_checklist', 'value'), 
     Input('metric_checklist', 'value'),
     Input('time_scale_checklist', 'value'), 
-    Input('scale_option', 'value'), 
     Input('gender_checklist', 'value'),
     Input('map_button', 'value'), 
     Input('date_range', 'start_date'), 
     Input('date_range', 'end_date'), 
-    Input('rug_checklist', 'value'),
-    Input('reverse_axis_button', 'value'),
     Input('trend_checklist', 'value'),
     Input('forecast_slider', 'value'),
     Input('unit_checklist', 'value'),
@@ -634,12 +1143,12 @@ def second_checklist_callback(selected_countries):
             )
 def graph_callback(
     selected_countries, selected_regions, selected_ages, 
-    selected_metrics, selected_interval, selected_scale,
-    selected_genders, selected_graph, start_date, end_date, 
-    rug_value, reverse_axis_value, selected_trend, forecast, 
-    selected_unit, chart_or_table, hist_end_date
+    selected_metrics, selected_interval, selected_genders, 
+    selected_graph, start_date, end_date, selected_trend, 
+    forecast, selected_unit, chart_or_table, hist_end_date
                 ):
-    """Plotting what has to be displayed (charts or map)
+    """Plotting what has to be displayed (charts or map), with a linear scale, 
+    the axis not reversed and no rug plot : these options are applied in the browser (see assets/figure.js)
 
     Parameters:
     -----------        
@@ -658,9 +1167,6 @@ def graph_callback(
     selected_interval : str
         the time interval used to display data (Cumulative, Daily, Weekly, etc.)
 
-    selected_scale : str
-        defines wether y axis has logarithmic or linear scale ('lin' for linear, everything else for logarithmic)
-
     selected_genders : str list
         the list of the genders to select
 
@@ -673,12 +1179,6 @@ def graph_callback(
     end_date : str 
         the last date to be considered
 
-    rug_value : bool
-        activates the rug plot option
-
-    reverse_axis_value : bool
-        activates the reverse axis option
-    
     selected_trend : str
         the trend that we want to plot
 
@@ -696,76 +1196,15 @@ def graph_callback(
 
     Returns:
     --------
-    fig : plotly Figure
-        the corresponding plot
+    fig : dict
+        the corresponding plot (JSON of a plotly Figure)
     """
-    if isinstance(selected_countries, str) or isinstance(selected_countries, str):
-        C = [selected_countries]
-    else:
-        C = selected_countries
-    if selected_countries in [[], None]:
-        C = ['France']
-    else:
-        pass
-
-    if isinstance(selected_regions, str):
-        R = [selected_regions]
-    else:
-        R = selected_regions
-    if selected_regions in [[], None] or regionError(df, C, R):
-        R = ['All']
-    elif 'All_regions' in selected_regions:
-        regions_list = list(regions_of_country(df, C))
-        if regions_list == []:
-            R = ['All']
-        else:
-            R = regions_list
-    else:
-        pass
-
-    if  isinstance(selected_ages, int) or isinstance(selected_ages, str):
-        A = [selected_ages]
-    else:
-        A = selected_ages
-    if selected_ages in [[], None]:
-        A = [i * 10 for i in range(4, 9)]
-    elif 888 in A:
-        A = [10 * i for i in range(11)]
-    else:
-        pass
-
-    if isinstance(selected_metrics, str) or isinstance(selected_metrics, str):
-        M = [selected_metrics]
-    else:
-        M = selected_metrics
-    if selected_metrics in [[], None]:
-        M = ['Deaths']
-    else:
-        M = adaptMetricsInterval(M, selected_interval)
+    check_data_version()
 
-    if selected_scale == 'lin':
-        S = False
-    else:
-        S = True
-
-    if isinstance(selected_genders, str) or isinstance(selected_genders, str):
-            G = [selected_genders]
-    else:
-        G = selected_genders
-    if selected_genders in [[], None]:
-        G = ['b']
-    else:
-        pass
-
-    if rug_value == ['rug']:
-        rug = 'rug'
-    else:
-        rug = ''
-
-    if reverse_axis_value == ['reverse']:
-        reverse = True
-    else:
-        reverse = False
+    C, R, A, M, G = normaliseSelection(
+                                    selected_countries, selected_regions, selected_ages, 
+                                    selected_metrics, selected_interval, selected_genders
+                                    )
 
     if selected_trend in ['No trend', None]:
         trend = 0
@@ -777,33 +1216,74 @@ def graph_callback(
     else:
         T = False
     
-    if selected_graph == 'worldmap':
-        fig = plt.plot_world_map(df, A[0], G[0], M[0], selected_unit, hist_end_date)
+    # the table replaces the chart and the histogram (see table_callback)
+    if T and selected_graph not in ['worldmap', 'usamap']:
+        return dash.no_update
 
-        return fig
+    # the figure only depends on the normalised inputs of its graph
+    if selected_graph in ['worldmap', 'usamap']:
+        key = (selected_graph, A[0], G[0], M[0], selected_unit, hist_end_date)
+    elif selected_graph == 'hist':
+        key = (selected_graph, C[0], tuple(R), G[0], M[0], trend, hist_end_date)
+    else:
+        key = (
+                'metrics', tuple(C), tuple(R), tuple(A), tuple(G), tuple(M), 
+                start_date, end_date, trend, forecast, selected_unit
+                )
 
-    elif selected_graph == 'usamap':
-        fig = plt.plot_usa_map(df, A[0], G[0], M[0], selected_unit, hist_end_date)
+    fig_json = FIGURE_CACHE.get(key)
+
+    if fig_json is not None:
+        return json.loads(fig_json)
 
-        return fig
+    if selected_graph == 'worldmap':
+        fig = plt.plot_world_map(
+                                load_data(None, (M[0],)), A[0], G[0], M[0], selected_unit, hist_end_date,
+                                index = load_latest_values(None, M[0])
+                                )
+
+    elif selected_graph == 'usamap':
+        fig = plt.plot_usa_map(
+                                load_data(('USA',), (M[0],)), A[0], G[0], M[0], selected_unit, hist_end_date,
+                                index = load_latest_values(('USA',), M[0])
+                                )
 
     elif selected_graph == 'hist':
         if R == []:
             R = ['All']
         else:
             pass
-        fig = plt.plot_histogram(df, C[0], R[0], G[0], M[0], S, trend, T, hist_end_date)
-
-        return fig
+        fig = plt.plot_histogram(load_data((C[0],), (M[0],)), C[0], R[0], G[0], M[0], False, trend, hist_end_date)
 
     else:
         fig = plt.plot_metrics(
-                                df, C, R, A, G, M, S, 
+                                load_data(tuple(sorted(C)), tuple(sorted(M))), C, R, A, G, M, False, 
                                 start_date, end_date, 
-                                rug, reverse, trend, forecast, 
-                                selected_unit, T)
+                                None, False, trend, forecast, 
+                                selected_unit, series = df_series, trend_cache = TREND_CACHE,
+                                downsample = DOWNSAMPLE_SERIES, 
+                                index = load_date_index(tuple(sorted(C)), tuple(sorted(M))))
+
+    fig_json = fig.to_json()
+    FIGURE_CACHE.put(key, fig_json)
+
+    return json.loads(fig_json)
 
-        return fig
+# The log scale, the reverse axis and the rug plot only change the displayed figure : 
+# they are applied in the browser (see assets/figure.js)
+app.clientside_callback(
+    ClientsideFunction(namespace = 'figure', function_name = 'cosmetic'),
+    Output('plot', 'figure'),
+    [
+    Input('figure_store', 'data'),
+    Input('scale_option', 'value'),
+    Input('rug_checklist', 'value'),
+    Input('reverse_axis_button', 'value')
+    ],
+    [
+    State('map_button', 'value')
+    ]
+                        )
 
 if __name__ == '__main__':
     app.run_server(debug=True)
\ No newline at end of file
@@ -0,0 +1,177 @@
+/*
+figure: Cosmetic options of the plot, applied in the browser
+=============================================
+
+The figure computed by graph_callback (app.py) is kept in the figure_store :
+linear scale, axis not reversed and no rug plot. The log scale, the reverse
+axis and the rug plot options are applied to a copy of it, without any
+request to the server : the rug plot is built from the values of the chart.
+
+Author : Lilian MAREY <lilian.marey@ensae.fr>
+*/
+
+// Formatting of the axis which moves with the data when the axis are reversed
+var AXIS_FORMAT = ['title', 'tickvals', 'ticktext', 'tickwidth', 'tickcolor', 'ticklen'];
+
+// Formatting of the value axis shared by the rug plot
+var RUG_AXIS_FORMAT = ['title', 'showline', 'linewidth', 'linecolor'];
+
+function swapKeys(a, b, keys) {
+    keys.forEach(function(key) {
+        var value = a[key];
+
+        if (b[key] === undefined) {delete a[key];} else {a[key] = b[key];}
+        if (value === undefined) {delete b[key];} else {b[key] = value;}
+    });
+}
+
+function reverseAxis(figure) {
+    var layout = figure.layout;
+    var x = null;
+
+    figure.data.forEach(function(trace) {
+        if (trace.type === 'box') {
+            // the rug plot of the main trace before it : its values are now the dates
+            trace.y = x;
+            if (trace.hovertemplate) {
+                trace.hovertemplate = trace.hovertemplate.replace(/<br>[^<]*=%\{y\}/, '');
+            }
+        } else if (trace.x !== undefined) {
+            x = trace.x;
+            trace.x = trace.y;
+            trace.y = x;
+            if (trace.hovertemplate) {
+                trace.hovertemplate = trace.hovertemplate
+                    .replace(/%\{x\}/g, '%{_}')
+                    .replace(/%\{y\}/g, '%{x}')
+                    .replace(/%\{_\}/g, '%{y}');
+            }
+        }
+    });
+
+    swapKeys(layout.xaxis || {}, layout.yaxis || {}, AXIS_FORMAT);
+    if (layout.xaxis2 && layout.yaxis2) {
+        swapKeys(layout.xaxis2, layout.yaxis2, ['title']);
+    }
+}
+
+function rugTrace(trace) {
+    // the rug plot of plotly express (marginal_y = 'rug') : the values as ticks of the trace color
+    return {
+        type: 'box',
+        name: trace.name,
+        legendgroup: trace.legendgroup,
+        offsetgroup: trace.name,
+        alignmentgroup: 'True',
+        showlegend: false,
+        xaxis: 'x2',
+        yaxis: 'y2',
+        y: trace.y,
+        customdata: trace.customdata,
+        hovertext: trace.hovertext,
+        hovertemplate: trace.hovertemplate,
+        hoveron: 'points',
+        boxpoints: 'all',
+        jitter: 0,
+        fillcolor: 'rgba(255,255,255,0)',
+        line: {color: 'rgba(255,255,255,0)'},
+        marker: {color: (trace.marker || {}).color, symbol: 'line-ew-open'}
+    };
+}
+
+function addRug(figure) {
+    var layout = figure.layout;
+    var data = [];
+
+    figure.data.forEach(function(trace) {
+        data.push(trace);
+        // the points of the series, not the trend curves
+        if (trace.mode === 'markers' && trace.legendgroup !== undefined) {
+            data.push(rugTrace(trace));
+        }
+    });
+
+    if (data.length === figure.data.length) {
+        return;
+    }
+    figure.data = data;
+
+    layout.xaxis = layout.xaxis || {};
+    layout.xaxis.domain = [0, 0.7363];
+    layout.xaxis2 = {
+        anchor: 'y2', domain: [0.7413, 1], matches: 'x2',
+        showticklabels: false, showline: false, ticks: '', showgrid: false
+    };
+    layout.yaxis2 = {
+        anchor: 'x2', domain: [0, 1], matches: 'y',
+        showticklabels: false, showgrid: true
+    };
+    RUG_AXIS_FORMAT.forEach(function(key) {
+        if ((layout.yaxis || {})[key] !== undefined) {
+            layout.yaxis2[key] = layout.yaxis[key];
+        }
+    });
+}
+
+function logScale(figure) {
+    Object.keys(figure.layout).forEach(function(key) {
+        if (/^yaxis\d*$/.test(key)) {
+            figure.layout[key].type = 'log';
+        }
+    });
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    figure: {
+        /*
+        Applies the cosmetic options to the figure of the figure_store
+
+        Parameters:
+        -----------
+        figure : object
+            the figure computed by graph_callback
+
+        scale : str
+            'lin' for linear scale, everything else for logarithmic
+
+        rug : str list
+            ['rug'] to display the rug plot
+
+        reverse : str list
+            ['reverse'] to reverse the axis
+
+        graph : str
+            the displayed graph ('chart', 'hist', 'worldmap' or 'usamap')
+
+        Returns:
+        --------
+            figure : object
+                the displayed figure
+        */
+        cosmetic: function(figure, scale, rug, reverse, graph) {
+            if (!figure) {
+                return window.dash_clientside.no_update;
+            }
+            if (graph === 'worldmap' || graph === 'usamap') {
+                return figure;
+            }
+
+            figure = JSON.parse(JSON.stringify(figure));
+            figure.layout = figure.layout || {};
+
+            if (graph !== 'hist') {
+                if ((rug || []).indexOf('rug') >= 0) {
+                    addRug(figure);
+                }
+                if ((reverse || []).indexOf('reverse') >= 0) {
+                    reverseAxis(figure);
+                }
+            }
+            if (scale !== 'lin') {
+                logScale(figure);
+            }
+
+            return figure;
+        }
+    }
+});
@@ -1,6 +1,6 @@
 """
-app: Module to run the app
-=============================================
+data_processing: Command-line tool building the preprocessed dataset
+====================================================================
 
 .. moduleauthor:: Lilian MAREY <lilian.marey@ensae.fr>
 
@@ -12,171 +12,392 @@ import dash_html_components as html
 
 from sys import exit
 from datetime import date
+from pathlib import Path
+import os
+import argparse
+import shutil
+import time
+import tempfile
 import pandas as pd
 
 from src.mysettings import *
 from src.helpers import *
 from src.preprocess import *
+from src.storage import replace_store, update_store, read_store, read_manifest, write_manifest, write_store_version
+from src.storage import apply_store_schema, memory_report, read_series, write_series
+from src.ingestion import read_harmonised, spool_by_country, read_spooled_country, spooled_countries
+from src.checkpoints import hashKey, fileKey, frameKey, codeKey, run_stages, checkpoint_directory, prune_checkpoints
 import src.plots as plt 
 
 ##########################################
-# Import needed data
-# Harmonised data on cases, deaths, tests
-
-print('Importation of input CSV files...')
-df_harmonised = pd.read_csv(HARMONISED_DATA_PATH, skiprows = [0, 1, 2])
-df_harmonised = df_harmonised[
-    ['Country', 'Region', 'Date', 'Sex', 'Age', 'Cases', 'Deaths', 'Tests']
-                            ]
-print('Done')
-
-###########################################
-# Delete detected untrue source
-df_harmonised = df_harmonised[-df_harmonised['Country'].isin(['UK'])]
-
-###########################################
-# Taking subset of data for experimentation : different sets depending on what you want to process
-print('Taking subset of data for experimentation...')
-
-# for processing the hole data : no selection
-
-df_harmonised = df_harmonised[df_harmonised['Country'].isin(['USA'])]
-
-df_harmonised = df_harmonised[df_harmonised['Region'].isin(['Ohio'])]
-
-# 'North Dakota', 'Ohio', 'Oklahoma'
-
-# for quick tests
-
-# df_harmonised = df_harmonised[df_harmonised['Region'].isin(['Corse'])]
-# df_harmonised = df_harmonised[df_harmonised['Sex'].isin(['b'])]
-# df_harmonised = df_harmonised[df_harmonised['Age'].isin([80])]
-
-
-# for an histogram
-
-# df_harmonised = df_harmonised[df_harmonised['Country'].isin(['France'])]
-# df_harmonised = df_harmonised[df_harmonised['Region'].isin(['Ile-de-France'])]
-# df_harmonised = df_harmonised[df_harmonised['Sex'].isin(['b'])]
-
-
-# a quite complete set, quite fast to process, for a complete demonstration
-
-# df1 = df_harmonised[df_harmonised['Region'].isin(['All'])].copy()
-# df1 = df1[df1['Sex'].isin(['b'])]
-# df1 = df1[df1['Age'].isin([80])]
-# df2 = df_harmonised[df_harmonised['Country'] == 'France'].copy()
-# df3 = df_harmonised[df_harmonised['Country'].isin(['USA'])]
-# df3 = df3[df3['Sex'].isin(['b'])]
-# df_harmonised = df3.merge(df1.merge(df2, 'outer'), 'outer')
-
-
-# for a world map
-
-# df_harmonised = df_harmonised[df_harmonised['Region'].isin(['All'])]
-# df_harmonised = df_harmonised[df_harmonised['Sex'].isin(['b'])]
-# df_harmonised = df_harmonised[df_harmonised['Age'].isin([80])]
-
-
-# for a USA map
-
-# df_harmonised = df_harmonised[df_harmonised['Country'].isin(['USA'])]
-# df_harmonised = df_harmonised[df_harmonised['Sex'].isin(['b'])]
-# df_harmonised = df_harmonised[df_harmonised['Age'].isin([80])]
-
-
-###########################################
-# Adding CFR column to the Harmonised data
-
-print('Adding CFR column to the Harmonised data')
-df_harmonised['CFR'] = computeRatio(
-                            df_harmonised['Deaths'],
-                            df_harmonised['Cases']
-                                    )
-print('Done')
-
-
-###########################################
-# Adding Tests by cases column to the Harmonised data
-
-print('Adding Cases_by_tests column to the Harmonised data')
-df_harmonised['Tests by cases'] = computeRatio(
-                            df_harmonised['Tests'],
-                            df_harmonised['Cases']
+# Settings of the processing
+
+# Families of metrics which can be built, and the time intervals they correspond to
+FAMILIES = ['ratios', 'daily', 'weekly', 'biweekly', 'monthly']
+FAMILY_INTERVALS = {
+                    'daily' : 'Daily ', 
+                    'weekly' : 'Weekly ', 
+                    'biweekly' : 'Biweekly ', 
+                    'monthly' : 'Monthly '
+                    }
+
+def familiesMetrics(families):
+    """Gives the metrics built by a processing restricted to some families
+
+    Parameters:
+    -----------
+    families : str list
+        the families of metrics built (see FAMILIES)
+
+    Returns:
+    --------
+        metrics : str list
+            the names of the metrics (the cumulative ones are always built)
+    """
+    metrics = ['Cases', 'Deaths', 'Tests']
+
+    if 'ratios' in families:
+        metrics += ['CFR', 'Tests by cases']
+
+    for family in families:
+        if family in FAMILY_INTERVALS:
+            metrics += [FAMILY_INTERVALS[family] + metric for metric in ['Deaths', 'Cases', 'Tests']]
+
+    return metrics
+
+def parseArguments(argv = None):
+    """Parses the command line of the processing
+
+    Parameters:
+    -----------
+    argv : str list
+        the arguments (None : sys.argv)
+
+    Returns:
+    --------
+        args : argparse.Namespace
+            the settings of the processing
+    """
+    parser = argparse.ArgumentParser(
+                description = 'Builds the preprocessed dataset read by the app from the harmonised data.',
+                epilog = '''examples :
+  quick test          : --regions Corse --sexes b --ages 80
+  histogram           : --countries France --regions Ile-de-France --sexes b
+  world map           : --regions All --sexes b --ages 80
+  USA map             : --countries USA --sexes b --ages 80
+  monthly ratios only : --countries Italy --families ratios monthly''',
+                formatter_class = argparse.RawDescriptionHelpFormatter
                                     )
-print('Done')
-
-###########################################
-# Sorting data
-
-print('Done')
-print('Data shape : ', df_harmonised.shape)
-print('Creating date_code column...')
-df_harmonised['Date_code'] = df_harmonised.apply(computeDatecode, axis = 1)
-print('Done')
-print('Sorting Dataframe...')
-df_harmonised = df_harmonised.sort_values(by = ['Date_code'])
-print('Done')
-
-###########################################
-# Computing dayly/weekly/monthly data 
-
-print('Melting dataframe...')
-df_harmonised = meltDataframe(df_harmonised)
-print('Done')
-
-###########################################
-# Adding gap_in_day and label column to the harmonised data
-
-print('Creating date_code column...')
-df_harmonised['gap_in_day'] = df_harmonised.apply(lambda row : time_delta('01/01/2020', row.Date), axis = 1)
-print('Done')
-
-print('Creating Country - Region - Age - Gender column...')
-df_harmonised['Country - Region - Age - Gender'] = df_harmonised.apply(
-                                                    lambda row : str(row.Country) + ' - ' 
-                                                                + row.Region + ' - ' 
-                                                                + str(row.Age) + '-' 
-                                                                + str(row.Age+sum(
-                                                                        [4 if row.Age == 100 else 9]
-                                                                                )
-                                                                    )
-                                                                + ' ans - ' + label_gender[row.Sex],
-                                                    axis = 1)
-print('Done')
-
-###########################################
-# Building time metrics
-
-print('Building time metrics...')
-df_harmonised = build_time_metrics(df_harmonised)
-print('Time metrics built')
-
-###########################################
-# Building date label column
-df_harmonised['Date_format'] = df_harmonised.apply(computeDateFormat, axis = 1)
 
+    # Taking subset of data (nothing given : no selection, for processing the whole data)
+    parser.add_argument('--countries', nargs = '+', help = 'countries to process (default : all)')
+    parser.add_argument('--regions', nargs = '+', help = 'regions to process (default : all)')
+    parser.add_argument('--sexes', nargs = '+', choices = list(label_gender), 
+                        help = 'sexes to process (default : all)')
+    parser.add_argument('--ages', nargs = '+', type = int, help = 'ages to process (default : all)')
+
+    # Input and outputs
+    parser.add_argument('--input', type = Path, default = HARMONISED_DATA_PATH, 
+                        help = 'harmonised CSV file (default : %(default)s)')
+    parser.add_argument('--output', type = Path, default = PREPROCESSED_DATA_PATH, 
+                        help = 'Parquet dataset to create or update (default : %(default)s)')
+    parser.add_argument('--manifest', type = Path, default = PREPROCESSED_MANIFEST_PATH, 
+                        help = 'manifest of the processed series (default : %(default)s)')
+    parser.add_argument('--series', type = Path, default = PREPROCESSED_SERIES_PATH, 
+                        help = 'series table of the dataset (default : %(default)s)')
+    parser.add_argument('--version-file', type = Path, default = PREPROCESSED_VERSION_PATH, 
+                        help = 'version of the dataset, watched by the app (default : %(default)s)')
+    parser.add_argument('--csv', type = Path, nargs = '?', const = PREPROCESSED_CSV_PATH, 
+                        help = 'also exports the whole dataset as CSV (default path : %(const)s)')
+    parser.add_argument('--float32', action = 'store_true', 
+                        help = 'stores the values as float32 (about 7 significant digits)')
+
+    # Processing
+    parser.add_argument('--families', nargs = '+', choices = FAMILIES, default = FAMILIES, 
+                        help = 'families of metrics to build (default : all)')
+    parser.add_argument('--workers', type = int, default = 1, 
+                        help = 'number of processes among which series are shared (default : %(default)s)')
+    parser.add_argument('--chunksize', type = int, default = HARMONISED_CHUNKSIZE, 
+                        help = 'rows read at once from the input (default : %(default)s)')
+    parser.add_argument('--full', action = 'store_true', 
+                        help = 'processes all the selected series, changed or not')
+    parser.add_argument('--checkpoints', type = Path, default = CHECKPOINTS_PATH, 
+                        help = 'directory of the outputs of the stages, to resume an interrupted processing (default : %(default)s)')
+    parser.add_argument('--no-checkpoints', action = 'store_true', 
+                        help = 'does not write the outputs of the stages')
+    parser.add_argument('--prune', action = 'store_true', 
+                        help = 'deletes all the checkpoints this processing did not use, '
+                                + 'including those of interrupted processings of other series '
+                                + '(default : those unused for %d days)' % (CHECKPOINTS_MAX_AGE // (24 * 3600)))
+
+    return parser.parse_args(argv)
 
-###################################
-# Corrections on original dataset to fit with other datasets
-
-df_harmonised['Region'] = df_harmonised['Region'].replace('Lousiana', 'Louisiana')
-df_harmonised['Region'] = df_harmonised['Region'].replace('NYC', 'New York')
-
-###################################
-# Computation of values by population
-
-df_harmonised['Value_by_pop'] = df_harmonised.apply(computeValuebyPop, axis = 1)
-
-
-
-
-###################################
-# Creation of file
-
-PATH = pathlib.Path(__file__).parent
-
-df_harmonised.to_csv(str(PATH) + '/data/preprocessed_data_update_6.csv')
+##########################################
+# Stages of the processing of the data of a country : each stage takes the output of
+# the previous one, and can be checkpointed (see src.checkpoints)
+
+def addRatios(df_harmonised):
+    """Adds the CFR and Tests by cases columns to the harmonised data (wide format)"""
+    print('Adding CFR column to the Harmonised data')
+    df_harmonised['CFR'] = computeRatio(
+                                df_harmonised['Deaths'],
+                                df_harmonised['Cases']
+                                        )
+    print('Done')
+
+    print('Adding Cases_by_tests column to the Harmonised data')
+    df_harmonised['Tests by cases'] = computeRatio(
+                                df_harmonised['Tests'],
+                                df_harmonised['Cases']
+                                        )
+    print('Done')
+
+    return df_harmonised
+
+def addDateColumns(df_harmonised):
+    """Adds the Date_code and gap_in_day columns, and sorts the data by date"""
+    print('Data shape : ', df_harmonised.shape)
+    print('Creating Date_code and gap_in_day columns...')
+    df_harmonised['Date_code'], df_harmonised['gap_in_day'] = computeDateColumns(df_harmonised['Date'])
+    print('Done')
+    print('Sorting Dataframe...')
+    df_harmonised = df_harmonised.sort_values(by = ['Date_code'])
+    print('Done')
+
+    return df_harmonised
+
+def addDateFormats(df_harmonised):
+    """Adds the Date_format column (date labels)"""
+    df_harmonised['Date_format'] = computeDateFormats(df_harmonised['Date_code'])
+
+    return df_harmonised
+
+def fixRegions(df_harmonised):
+    """Corrections on original dataset to fit with other datasets (done after the time
+    metrics : the series are identified by their original regions, 'NYC' and 'New York'
+    are distinct series)"""
+    df_harmonised['Region'] = df_harmonised['Region'].replace(region_corrections)
+
+    return df_harmonised
+
+def addValuesByPop(df_harmonised):
+    """Adds the Value_by_pop column"""
+    df_harmonised['Value_by_pop'] = computeValuesbyPop(df_harmonised)
+
+    return df_harmonised
 
-print('File created')
+##########################################
+# Processing of the data of a country
+
+def process_country(df_harmonised, families = FAMILIES, workers = 1, checkpoints_path = None):
+    """Computes the preprocessed data from the harmonised data of a country.
+    The output of each stage is checkpointed, keyed by its input, code and parameters :
+    a rerun resumes from the last stage computed.
+
+    Parameters:
+    -----------
+    df_harmonised : Pandas DataFrame
+        the harmonised data (wide format)
+
+    families : str list
+        the families of metrics to build (see FAMILIES)
+
+    workers : int
+        number of processes among which series are shared
+
+    checkpoints_path : str or pathlib.Path
+        the directory of the checkpoints (None for no checkpoint)
+
+    Returns:
+    --------
+        df_harmonised : Pandas DataFrame
+            the preprocessed data (long format)
+    """
+    intervals = [FAMILY_INTERVALS[family] for family in families if family in FAMILY_INTERVALS]
+
+    # files read by the stages, besides their input
+    population_key = hashKey(fileKey(POPULATION_DATA_PATH), fileKey(USSTATES_DATA_PATH))
+
+    stages = [
+            ('ratios', addRatios, {}, {}, []),
+            ('date_columns', addDateColumns, {}, {}, []),
+            ('melt', meltDataframe, {}, {}, []),
+            ('time_metrics', build_time_metrics, {'intervals' : intervals}, {'workers' : workers}, []),
+            ('date_formats', addDateFormats, {}, {}, []),
+            ('regions', fixRegions, {}, {}, []),
+            ('values_by_pop', addValuesByPop, {}, {}, [population_key]),
+                ]
+
+    if 'ratios' not in families:
+        stages = stages[1:]
+
+    df_harmonised = run_stages(
+                            stages, 
+                            df_harmonised, 
+                            frameKey(df_harmonised), 
+                            checkpoints_path = checkpoints_path
+                                )
+
+    return df_harmonised
 
+##########################################
+# Processing
+
+def main(argv = None):
+    """Runs the processing described by the command line
+
+    Parameters:
+    -----------
+    argv : str list
+        the arguments (None : sys.argv)
+    """
+    args = parseArguments(argv)
+
+    # Change detection and manifest only make sense when every family is built : a partial
+    # rebuild reprocesses all the selected series and only replaces the metrics it builds
+    all_families = set(args.families) == set(FAMILIES)
+    replaced_metrics = None if all_families else familiesMetrics(args.families)
+
+    ##########################################
+    # Import needed data
+    # Harmonised data on cases, deaths, tests : read by chunks (detected untrue source deleted,
+    # subset taken), and spooled by country
+
+    print('Importation of input CSV files...')
+    args.output.parent.mkdir(parents = True, exist_ok = True)
+    start_time = time.time()
+
+    def spool(spool_path):
+        spool_by_country(
+                        read_harmonised(
+                                        args.input, 
+                                        countries = args.countries, 
+                                        regions = args.regions, 
+                                        sexes = args.sexes, 
+                                        ages = args.ages,
+                                        chunksize = args.chunksize
+                                        ),
+                        spool_path
+                        )
+
+    # a rebuild of the whole dataset is written beside the served one, which is only
+    # replaced once the rebuild succeeded (see src.storage.replace_store)
+    build_path = None
+    spool_path = tempfile.mkdtemp(dir = args.output.parent) if args.no_checkpoints else None
+
+    try:
+        if args.no_checkpoints:
+            spool(spool_path)
+        else:
+            spool_key = hashKey(
+                                fileKey(args.input), 
+                                args.countries, args.regions, args.sexes, args.ages,
+                                codeKey(read_harmonised), codeKey(spool_by_country)
+                                )
+            spool_path = checkpoint_directory('spool', spool_key, spool, args.checkpoints)
+
+        countries = spooled_countries(spool_path)
+        print('Done')
+
+        old_manifest = read_manifest(args.manifest)
+        series = read_series(args.series)
+        output_path = args.output
+        series_path = args.series
+
+        if old_manifest is None or series is None or not args.output.exists():
+            if not all_families:
+                print('No existing dataset : all the families are built')
+                all_families = True
+                replaced_metrics = None
+
+            old_manifest = None
+            series = None
+            build_path = Path(tempfile.mkdtemp(dir = args.output.parent))
+            output_path = build_path.joinpath(args.output.name)
+            series_path = build_path.joinpath(args.series.name)
+
+        incremental = all_families and not args.full and old_manifest is not None
+
+        ###########################################
+        # Processing of the data, country by country : the Parquet dataset is updated with
+        # the series of each country
+
+        manifests = []
+
+        for country in countries:
+            print('Processing ' + country + '...')
+            df_harmonised = read_spooled_country(spool_path, country)
+            manifest = seriesManifest(df_harmonised)
+
+            if incremental:
+                changed_labels = changedSeries(old_manifest, manifest)
+                manifest = manifest[manifest['Country - Region - Age - Gender'].isin(changed_labels)]
+                df_harmonised = df_harmonised.merge(
+                                                manifest[['Country', 'Region', 'Age', 'Sex']], 
+                                                on = ['Country', 'Region', 'Age', 'Sex']
+                                                    )
+                print('Series to process : ', len(changed_labels))
+
+                if df_harmonised.empty:
+                    continue
+
+            df_harmonised['series_id'], series = assignSeriesIds(df_harmonised, series)
+            write_series(series, series_path)
+
+            families = args.families if not all_families else FAMILIES
+            df_harmonised = process_country(
+                                            df_harmonised, 
+                                            families = families, 
+                                            workers = args.workers, 
+                                            checkpoints_path = None if args.no_checkpoints else args.checkpoints
+                                            )
+
+            float_dtype = 'float32' if args.float32 else FLOAT_DTYPE
+            df_compact = apply_store_schema(df_harmonised, float_dtype = float_dtype)
+            print('Memory footprint :')
+            print(memory_report(df_harmonised, df_compact))
+
+            update_store(
+                        df_compact, 
+                        df_compact['series_id'].unique(), 
+                        output_path, 
+                        replaced_metrics = replaced_metrics, 
+                        float_dtype = float_dtype
+                        )
+            manifests.append(manifest)
+
+            # the served dataset has changed : the app empties its caches
+            if build_path is None:
+                write_store_version(args.version_file)
+
+        if build_path is not None and output_path.exists():
+            replace_store(output_path, args.output)
+            os.replace(series_path, args.series)
+            write_store_version(args.version_file)
+
+    finally:
+        if args.no_checkpoints and spool_path is not None:
+            shutil.rmtree(spool_path)
+        if build_path is not None:
+            shutil.rmtree(build_path, ignore_errors = True)
+
+    # the checkpoints of other selections (other countries...) may be needed to resume an
+    # interrupted processing : only the old ones are deleted, unless asked
+    if not args.no_checkpoints:
+        prune_checkpoints(args.checkpoints, start_time if args.prune else time.time() - CHECKPOINTS_MAX_AGE)
+
+    ###################################
+    # Creation of files : Parquet store read by the app, CSV export if wanted
+
+    if manifests and all_families:
+        write_manifest(pd.concat(manifests), args.manifest, update = old_manifest is not None)
+    elif not manifests:
+        print('No changed series')
+
+    if args.csv is not None:
+        attachLabels(read_store(args.output), read_series(args.series)).to_csv(args.csv)
+
+    print('File created')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+cache: Caches of the results computed by the app
+=============================================
+
+.. moduleauthor:: Lilian MAREY <lilian.marey@ensae.fr>
+
+"""
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Least recently used cache, bounded by a total size of its entries.
+    It is emptied when the version of the dataset it was computed from changes.
+    It can be shared between the threads of the server.
+
+    Parameters:
+    -----------
+    maxsize : int
+        the maximal total size of the entries
+
+    sizeof : function
+        gives the size of an entry (by default : 1, the size bounds the number of entries)
+    """
+    def __init__(self, maxsize, sizeof = None):
+        self.maxsize = maxsize
+        self.sizeof = sizeof if sizeof is not None else (lambda value : 1)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.version = None
+        self.lock = threading.RLock()
+
+    def validate(self, version):
+        """Empties the cache if the version of the dataset has changed
+
+        Parameters:
+        -----------
+        version : str
+            the version of the dataset (see src.storage.store_version)
+        """
+        with self.lock:
+            if version != self.version:
+                self.clear()
+                self.version = version
+
+    def get(self, key, default = None):
+        """Gives the entry of a key, which becomes the most recently used one
+
+        Parameters:
+        -----------
+        key : hashable
+            the key of the entry
+
+        default : any
+            the value returned if the key is not cached
+
+        Returns:
+        --------
+            value : any
+                the cached value (default if not cached)
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+
+            return self.entries[key][0]
+
+    def put(self, key, value):
+        """Caches an entry, evicting the least recently used ones beyond the maximal size
+
+        Parameters:
+        -----------
+        key : hashable
+            the key of the entry
+
+        value : any
+            the value to cache (not cached if it is larger than the cache)
+        """
+        size = self.sizeof(value)
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+
+            if size > self.maxsize:
+                return
+
+            self.entries[key] = (value, size)
+            self.size += size
+
+            while self.size > self.maxsize:
+                evicted_key, (evicted_value, evicted_size) = self.entries.popitem(last = False)
+                self.size -= evicted_size
+
+    def clear(self):
+        """Empties the cache (the counters are kept)"""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """Gives the counters of the cache
+
+        Returns:
+        --------
+            stats : dict
+                the numbers of hits, misses and entries, and the total size of the entries
+        """
+        with self.lock:
+            return {
+                    'hits' : self.hits,
+                    'misses' : self.misses,
+                    'entries' : len(self.entries),
+                    'size' : self.size
+                    }
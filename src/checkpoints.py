@@ -0,0 +1,285 @@
+"""
+checkpoints: Functions to persist the outputs of the preprocessing stages
+=============================================
+
+.. moduleauthor:: Lilian MAREY <lilian.marey@ensae.fr>
+
+"""
+import os
+import time
+import shutil
+import hashlib
+import inspect
+import pathlib
+import tempfile
+import pandas as pd
+
+REPOSITORY_MODULES = ['src', 'data_processing', '__main__']
+
+# Checkpoints being written (by this run or by a concurrent one) : kept by prune_checkpoints,
+# unless they were left by a crash for more than TMP_MAX_AGE seconds
+TMP_PREFIX = 'tmp-'
+TMP_SUFFIX = '.tmp'
+TMP_MAX_AGE = 24 * 3600
+
+def hashKey(*parts):
+    """Builds a key from the representation of some values
+
+    Parameters:
+    -----------
+    parts : any
+        the values identifying an object (must have a stable representation)
+
+    Returns
+    -----------
+        key : str
+            the hexadecimal hash of the values
+    """
+    return hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+
+def fileKey(path):
+    """Builds a key identifying a file and its version, without reading it
+
+    Parameters:
+    -----------
+    path : str or pathlib.Path
+        the file
+
+    Returns
+    -----------
+        key : str
+            the hash of the path, size and modification time of the file
+    """
+    path = pathlib.Path(path).resolve()
+    stat = path.stat()
+
+    return hashKey(str(path), stat.st_size, stat.st_mtime_ns)
+
+def frameKey(df):
+    """Builds a key identifying the content of a dataframe
+
+    Parameters:
+    -----------
+    df : Pandas DataFrame
+        the dataframe
+
+    Returns
+    -----------
+        key : str
+            the hash of the values, index, columns and types of the dataframe
+    """
+    row_hashes = pd.util.hash_pandas_object(df, index = True).values
+
+    return hashKey(
+                hashlib.sha256(row_hashes.tobytes()).hexdigest(),
+                list(df.columns),
+                [str(dtype) for dtype in df.dtypes]
+                    )
+
+def codeKey(func):
+    """Builds a key identifying the code of a function and of the functions of the
+    repository it calls, so that a stage is recomputed when its code changes
+
+    Parameters:
+    -----------
+    func : function
+        the function computing a stage
+
+    Returns
+    -----------
+        key : str
+            the hash of the sources
+    """
+    sources = []
+    seen = set()
+    to_visit = [func]
+
+    while to_visit:
+        f = to_visit.pop()
+
+        if f in seen:
+            continue
+
+        seen.add(f)
+        sources.append(inspect.getsource(f))
+
+        # names used by the function and by its nested functions (lambdas...)
+        names = []
+        codes = [f.__code__]
+
+        while codes:
+            code = codes.pop()
+            names += code.co_names
+            codes += [const for const in code.co_consts if inspect.iscode(const)]
+
+        for name in names:
+            called = f.__globals__.get(name)
+
+            # only the functions of the repository, the libraries are assumed stable
+            if inspect.isfunction(called) and called.__module__.split('.')[0] in REPOSITORY_MODULES:
+                to_visit.append(called)
+
+    return hashKey(sorted(sources))
+
+def stageKey(name, func, input_key, params = {}, dependencies = []):
+    """Builds the key of the output of a stage
+
+    Parameters:
+    -----------
+    name : str
+        the name of the stage
+
+    func : function
+        computes the output of the stage
+
+    input_key : str
+        the key of the input (see frameKey, or the key of the previous stage)
+
+    params : dict
+        the parameters of the stage which change its output
+
+    dependencies : str list
+        the keys of the other data read by the stage (see fileKey)
+
+    Returns
+    -----------
+        key : str
+            the key of the output
+    """
+    return hashKey(name, input_key, codeKey(func), sorted(params.items()), dependencies)
+
+def run_stages(stages, df, input_key, checkpoints_path = None):
+    """Runs a sequence of stages, each one taking the output of the previous one.
+    The output of each stage is written in a checkpoint keyed by its input, code and
+    parameters : the stages are resumed from the last checkpoint found.
+
+    Parameters:
+    -----------
+    stages : (str, function, dict, dict, str list) list
+        the name, function, parameters, options and dependencies of each stage :
+        its output is func(df, **params, **options), options (number of workers...)
+        do not change the output, dependencies are keys of the other data read by the stage
+
+    df : Pandas DataFrame
+        the input of the first stage
+
+    input_key : str
+        the key of the input (see frameKey)
+
+    checkpoints_path : str or pathlib.Path
+        the directory of the checkpoints (None for no checkpoint)
+
+    Returns
+    -----------
+        df : Pandas DataFrame
+            the output of the last stage
+    """
+    # the keys only depend on the key of the input : they are known before running anything
+    keys = []
+
+    for name, func, params, options, dependencies in stages:
+        input_key = stageKey(name, func, input_key, params, dependencies)
+        keys.append(input_key)
+
+    if checkpoints_path is None:
+        paths = [None for stage in stages]
+    else:
+        pathlib.Path(checkpoints_path).mkdir(parents = True, exist_ok = True)
+        paths = [pathlib.Path(checkpoints_path).joinpath(stage[0] + '-' + key + '.parquet')
+                    for stage, key in zip(stages, keys)]
+
+    first = 0
+
+    for i in reversed(range(len(stages))):
+        if paths[i] is not None and paths[i].exists():
+            print('Stage ' + stages[i][0] + ' : checkpoint found')
+            df = pd.read_parquet(paths[i])
+            first = i + 1
+            break
+
+    # the checkpoints found are kept (see prune_checkpoints)
+    for path in paths[:first]:
+        if path.exists():
+            os.utime(path)
+
+    for (name, func, params, options, dependencies), path in zip(stages[first:], paths[first:]):
+        print('Stage ' + name + '...')
+        df = func(df, **params, **options)
+
+        if path is not None:
+            # the checkpoint is only visible once fully written, a crash never leaves a partial one
+            tmp_path = path.with_suffix(TMP_SUFFIX)
+            df.to_parquet(tmp_path, engine = 'pyarrow')
+            os.replace(tmp_path, path)
+
+    return df
+
+def checkpoint_directory(name, key, build, checkpoints_path):
+    """Gives a directory built once for a key (a spooled dataset for instance)
+
+    Parameters:
+    -----------
+    name : str
+        the name of the stage
+
+    key : str
+        the key of the input and parameters of the stage
+
+    build : function
+        fills an empty directory : build(path)
+
+    checkpoints_path : str or pathlib.Path
+        the directory of the checkpoints
+
+    Returns
+    -----------
+        path : pathlib.Path
+            the built directory
+    """
+    path = pathlib.Path(checkpoints_path).joinpath(name + '-' + key)
+
+    if path.exists():
+        print('Stage ' + name + ' : checkpoint found')
+        os.utime(path)
+        return path
+
+    pathlib.Path(checkpoints_path).mkdir(parents = True, exist_ok = True)
+    tmp_path = pathlib.Path(tempfile.mkdtemp(prefix = TMP_PREFIX, dir = checkpoints_path))
+    build(tmp_path)
+    os.replace(tmp_path, path)
+
+    return path
+
+def prune_checkpoints(checkpoints_path, since):
+    """Deletes the checkpoints which were neither written nor read since a time
+
+    Parameters:
+    -----------
+    checkpoints_path : str or pathlib.Path
+        the directory of the checkpoints
+
+    since : float
+        the time (as given by time.time()) of the beginning of the run
+    """
+    checkpoints_path = pathlib.Path(checkpoints_path)
+
+    if not checkpoints_path.exists():
+        return
+
+    for path in checkpoints_path.iterdir():
+        # a checkpoint being written may still be needed by a concurrent run
+        if path.name.startswith(TMP_PREFIX) or path.name.endswith(TMP_SUFFIX):
+            limit = min(since, time.time() - TMP_MAX_AGE)
+        else:
+            limit = since
+
+        try:
+            if path.stat().st_mtime < limit:
+                if path.is_dir():
+                    shutil.rmtree(path)
+                else:
+                    path.unlink()
+
+        # renamed or deleted by a concurrent run meanwhile
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,217 @@
+"""
+export: Functions to stream the downloaded data
+=============================================
+
+.. moduleauthor:: Lilian MAREY <lilian.marey@ensae.fr>
+
+"""
+import io
+import zlib
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.mysettings import EXPORT_CHUNKSIZE
+from src.storage import read_store_batches
+
+# Formats of the downloaded data : file extension and mimetype
+EXPORT_FORMATS = {
+    'csv' : ('csv', 'text/csv'),
+    'csv.gz' : ('csv.gz', 'application/gzip'),
+    'parquet' : ('parquet', 'application/vnd.apache.parquet'),
+}
+
+# Columns of the downloaded data
+EXPORT_COLUMNS = ['Date_format', 'Metric', 'Value', 'Country', 'Region', 'Age', 'Sex']
+
+def export_batches(path, countries_list, regions_list, ages_list, genders_list, metrics,
+                    start_date, end_date, batch_size = EXPORT_CHUNKSIZE):
+    """Reads the data downloaded with a chart (the selection of src.plots.build_download_file),
+    batch of rows by batch of rows from the preprocessed dataset
+
+    Parameters:
+    -----------
+    path : str or pathlib.Path
+        the preprocessed dataset (see src.storage.read_store_batches)
+
+    countries_list, regions_list, ages_list, genders_list, metrics : lists
+        the countries, regions, age ranges, genders and metrics to select
+
+    start_date, end_date : str
+        the first and last dates (format : YYYY MM DD)
+
+    batch_size : int
+        the largest number of rows of a batch
+
+    Returns:
+    -----------
+        batches : generator of Pandas DataFrame
+            the corresponding rows (one empty batch if no row is selected)
+    """
+    day1, month1, year1 = start_date[8:10], start_date[5:7], start_date[:4]
+    day2, month2, year2 = end_date[8:10], end_date[5:7], end_date[:4]
+
+    datecode1, datecode2 = int(year1 + month1 + day1), int(year2 + month2 + day2)
+
+    filters = [
+            ('Country', 'in', list(countries_list)),
+            ('Metric', 'in', list(metrics)),
+            ('Region', 'in', list(regions_list)),
+            ('Age', 'in', list(ages_list)),
+            ('Sex', 'in', list(genders_list)),
+            ('Date_code', '>=', datecode1),
+            ('Date_code', '<=', datecode2)
+            ]
+
+    empty = True
+
+    for df in read_store_batches(path, filters = filters, columns = EXPORT_COLUMNS, batch_size = batch_size):
+        empty = False
+        yield df
+
+    if empty:
+        yield pd.DataFrame(columns = EXPORT_COLUMNS)
+
+def csv_chunks(batches):
+    """Serialises batches of rows as one CSV file, batch by batch (the rows are numbered
+    over the whole file)
+
+    Parameters:
+    -----------
+    batches : iterable of Pandas DataFrame
+        the data to serialise (at least one batch, all with the same columns)
+
+    Returns:
+    -----------
+        chunks : generator of bytes
+            the header and the rows of the first batch, then the rows of each batch
+    """
+    header = True
+    start = 0
+
+    for df in batches:
+        df = df.set_axis(pd.RangeIndex(start, start + len(df)))
+
+        yield df.to_csv(header = header).encode()
+
+        header = False
+        start += len(df)
+
+def gzip_chunks(chunks):
+    """Compresses a stream of bytes into a gzip file, chunk by chunk
+
+    Parameters:
+    -----------
+    chunks : iterable of bytes
+        the data to compress
+
+    Returns:
+    -----------
+        chunks : generator of bytes
+            the gzip file
+    """
+    compressor = zlib.compressobj(wbits = zlib.MAX_WBITS | 16)
+
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
+
+class ChunkSink(io.RawIOBase):
+    """Output of a Parquet writer kept in memory only until it is sent : the bytes
+    written since the last call to take"""
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+
+        return len(data)
+
+    def tell(self):
+        # the offsets written in the footer of the file count the bytes already taken
+        return self.size
+
+    def take(self):
+        chunk = b''.join(self.chunks)
+        self.chunks = []
+
+        return chunk
+
+def parquet_chunks(batches):
+    """Serialises batches of rows as one Parquet file, one row group by batch, each row
+    group sent once written
+
+    Parameters:
+    -----------
+    batches : iterable of Pandas DataFrame
+        the data to write (at least one batch, all with the same columns)
+
+    Returns:
+    -----------
+        chunks : generator of bytes
+            the Parquet file
+    """
+    sink = ChunkSink()
+    writer = None
+
+    try:
+        for df in batches:
+            table = pa.Table.from_pandas(df, preserve_index = False)
+
+            if writer is None:
+                # the categories of each batch are its own : the labels are written as strings
+                schema = pa.schema([
+                                    pa.field(field.name, field.type.value_type)
+                                    if pa.types.is_dictionary(field.type) else field
+                                    for field in table.schema
+                                    ])
+                writer = pq.ParquetWriter(sink, schema, compression = 'zstd')
+
+            writer.write_table(table.cast(schema))
+
+            yield sink.take()
+
+    finally:
+        if writer is not None:
+            writer.close()
+
+    yield sink.take()
+
+def export_chunks(batches, export_format = 'csv'):
+    """Serialises the downloaded data in a format, as a stream of chunks : the whole file
+    is never held in memory, its size is not known before it is sent
+
+    Parameters:
+    -----------
+    batches : iterable of Pandas DataFrame
+        the downloaded data (see export_batches)
+
+    export_format : str
+        the format of the file (a key of EXPORT_FORMATS)
+
+    Returns:
+    -----------
+        chunks : generator of bytes
+            the content of the file
+    """
+    if export_format == 'csv':
+        return csv_chunks(batches)
+
+    elif export_format == 'csv.gz':
+        return gzip_chunks(csv_chunks(batches))
+
+    elif export_format == 'parquet':
+        return parquet_chunks(batches)
+
+    else:
+        raise ValueError('unknown export format : ' + str(export_format))
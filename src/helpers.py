@@ -6,14 +6,12 @@ helpers: Helper functions to preprocess data
 
 """
 import numpy as np
+import pandas as pd
 from datetime import date, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, get_all_start_methods
 
-# functions for regression
-from sklearn.linear_model import Ridge
-from sklearn.preprocessing import PolynomialFeatures
-from sklearn.pipeline import make_pipeline
-
-from src.mysettings import firsts_of_the_month
+from src.mysettings import first_day, label_gender
 
 def delete_spaces(s):
     """Deletes all the spaces of a string
@@ -75,6 +73,31 @@ def computeDatecodeFromGap(n):
 
     return datecode
 
+def datecodesFromGaps(gaps):
+    """Computes Datecodes from an array of gap_in_day values
+
+    Parameters:
+    -----------
+    gaps : numpy array
+        the numbers of days between the wanted dates and 2020.01.01
+
+    Returns
+    -----------
+        datecodes : numpy array
+            the corresponding datecodes
+    """
+    days = np.datetime64(first_day, 'D') + np.asarray(gaps, dtype = np.int64)
+    months = days.astype('datetime64[M]')
+    years = days.astype('datetime64[Y]')
+
+    datecodes = (
+                10000 * (years.astype(np.int64) + 1970)
+                + 100 * (months.astype(np.int64) % 12 + 1)
+                + (days - months.astype('datetime64[D]')).astype(np.int64) + 1
+                )
+
+    return datecodes
+
 def ageRange(row):
     """Gives the age range label for histogram
     -----------
@@ -94,6 +117,24 @@ def ageRange(row):
 
     return label
 
+def ageRanges(ages):
+    """Gives the age range labels for histogram of a column of ages
+
+    Parameters:
+    -----------
+    ages : pandas Series
+        Age column of a dataset
+
+    Returns
+    -----------
+       labels : pandas Series
+            the corresponding labels (str)
+    """
+    ages = ages.astype(np.int64)
+    labels = ages.astype(str) + '-' + (ages + 9).astype(str)
+
+    return labels.mask(ages == 100, '100-104')
+
 def regionError(df, C, R):
     """Detects if a selected region is not part of one of the selected countries
 
@@ -150,7 +191,9 @@ def adaptMetricsInterval(metrics, interval):
     return M
 
 def adaptDataframeHistogram(df, max_gap):
-    """Builds dataframe used to display histogram
+    """Builds dataframe used to display histogram : for each age range, the latest row
+    up to a date (the first one in the order of the dataset on a tie, when many series
+    share a region, see fixRegions)
     -----------
     df : Pandas DataFrame
         the original dataframe
@@ -163,21 +206,27 @@ def adaptDataframeHistogram(df, max_gap):
        df : Pandas DataFrame
             the corresponding dataframe
     """
-    df0 = df[df['gap_in_day'] <= max_gap].copy()
+    df0 = df[df['gap_in_day'] <= max_gap]
 
-    for age in range(0, 101, 10):
-        df1 = df0[df0['Age'] == age]
-        df0 = df0.drop(list(df1.index.values)[:-1])
-        
-    return df0
+    # by date, then against the order of the dataset : the kept row of each age is the last one
+    positions = np.arange(len(df0))
+    order = np.lexsort((-positions, df0['gap_in_day'].to_numpy()))
+
+    # the rows of the other ages are all kept
+    ages = df0['Age'].iloc[order]
+    dropped = np.empty(len(df0), dtype = bool)
+    dropped[order] = ages.duplicated(keep = 'last').to_numpy() & ages.isin(range(0, 101, 10)).to_numpy()
+
+    return df0[~dropped].copy()
 
 def dfadaptDateRange(df, start_date, end_date):
     """Slices dataframe keeping values between start-date and end_date
+    (see select_date_range for a dataset indexed once by date_range_index)
 
     Parameters:
     -----------
     -df : Pandas DataFrame
-        the dataset, asuming that it is sorted by date (with "Date_code")
+        the dataset
     -start_date : str 
         format : YYYY MM DD
     -end_date : str 
@@ -198,6 +247,94 @@ def dfadaptDateRange(df, start_date, end_date):
 
     return df0
 
+def date_range_index(df):
+    """Builds the lookup of the date ranges of a dataset (see select_date_range), once for all
+    the selections and dates : the rows of each (series_id, Metric) block are in date order,
+    as src.storage.read_store gives them
+
+    Parameters:
+    -----------
+    df : Pandas DataFrame
+        the dataset, with contiguous (series_id, Metric) blocks sorted by date (see sort_series)
+
+    Returns:
+    -----------
+        index : dict
+            'blocks' : one row by block, its Country, Region, Age, Sex, Metric and first (start)
+            and last + 1 (stop) rows,
+            'keys' : Date_code shifted by block (increasing over the whole dataset),
+            'span' : the shift between two blocks
+    """
+    offsets = series_offsets(df)
+    starts = offsets['start'].to_numpy()
+    lengths = (offsets['stop'] - offsets['start']).to_numpy()
+
+    # Date_code (YYYYMMDD < 10**8) shifted by block : one binary search gives the ranges of all
+    # the blocks (missing Date_code, out of any range, come first in their block)
+    span = 10 ** 8
+    block_starts = np.arange(len(offsets), dtype = np.int64) * span
+    keys = np.repeat(block_starts, lengths) + df['Date_code'].to_numpy(dtype = np.int64, na_value = 0)
+
+    blocks = df[['Country', 'Region', 'Age', 'Sex', 'Metric']].iloc[starts].reset_index(drop = True)
+    blocks['start'] = starts
+    blocks['stop'] = offsets['stop'].to_numpy()
+
+    index = {
+            'blocks' : blocks,
+            'keys' : keys,
+            'span' : span
+            }
+
+    return index
+
+def select_date_range(df, index, countries_list, regions_list, ages_list, genders_list, metrics, 
+                        start_date, end_date):
+    """Extracts from the dataset the data of some series and metrics between two dates
+    (as select_data, dfadaptDateRange and a selection of the metrics would) : the blocks are
+    selected in the lookup, and the bounds of the range in each of them are found by binary
+    search, so that the rows outside of the selection are never read
+
+    Parameters:
+    -----------
+    df : Pandas DataFrame
+        the dataset
+
+    index : dict
+        the lookup of the dataset (see date_range_index)
+
+    countries_list, regions_list, ages_list, genders_list, metrics : lists
+        the countries, regions, age ranges, genders and metrics to select
+
+    start_date, end_date : str
+        the first and last dates (format : YYYY MM DD)
+
+    Returns:
+    -----------
+        df : Pandas DataFrame
+            the corresponding rows, in the order of the dataset
+    """
+    day1, month1, year1 = start_date[8:10], start_date[5:7], start_date[:4]
+    day2, month2, year2 = end_date[8:10], end_date[5:7], end_date[:4]
+
+    datecode1, datecode2 = int(year1 + month1 + day1), int(year2 + month2 + day2)
+
+    blocks = index['blocks']
+    mask = (
+            blocks['Country'].isin(countries_list) & blocks['Region'].isin(regions_list) 
+            & blocks['Age'].isin(ages_list) & blocks['Sex'].isin(genders_list) 
+            & blocks['Metric'].isin(metrics)
+            ).to_numpy()
+
+    block_starts = np.flatnonzero(mask).astype(np.int64) * index['span']
+    lo = np.searchsorted(index['keys'], block_starts + datecode1, side = 'left')
+    hi = np.searchsorted(index['keys'], block_starts + datecode2, side = 'right')
+
+    # rows of the ranges [lo, hi[ of the selected blocks
+    counts = np.maximum(hi - lo, 0)
+    rows = np.arange(counts.sum()) + np.repeat(lo - (np.cumsum(counts) - counts), counts)
+
+    return df.iloc[rows]
+
 def computeRatio(indicator1, indicator2):
     """Computation of ratio of 2 inidcators.
     Parameters:
@@ -257,6 +394,78 @@ def computeDatecode(row):
 
     return N   
 
+def computeDateColumns(dates):
+    """Computes the Date_code and gap_in_day columns from a column of dates,
+    parsing each distinct date only once
+
+    Parameters:
+    -----------
+    dates : pandas Series
+        dates of a dataset (format : 'DD.MM.YYYY')
+
+    Returns:
+    -----------
+        datecodes : pandas Series
+            the datecodes (the datecode of the day before 2020.01.01 for wrong date formats,
+            as the gap : the rows of wrong dates are kept, first in their series)
+
+        gaps : pandas Series
+            the numbers of days since 2020.01.01 (-1 for wrong date formats)
+    """
+    labels, uniques = pd.factorize(dates)
+    parsed = pd.to_datetime(
+                            pd.Series(uniques, dtype = object),
+                            format = '%d.%m.%Y',
+                            errors = 'coerce'
+                            )
+    valid = parsed.notna().to_numpy()
+
+    # datecode of the gap -1 for wrong dates : the codes stay integers
+    wrong_datecode = computeDatecodeFromGap(-1)
+
+    unique_datecodes = np.where(
+                                valid,
+                                10000 * parsed.dt.year + 100 * parsed.dt.month + parsed.dt.day,
+                                wrong_datecode
+                                )
+    unique_gaps = np.where(
+                            valid,
+                            (parsed - pd.Timestamp(first_day)).dt.days,
+                            -1
+                            )
+
+    # missing dates are labelled -1 by factorize : last position
+    unique_datecodes = np.append(unique_datecodes, wrong_datecode).astype(np.int64)
+    unique_gaps = np.append(unique_gaps, -1).astype(np.int64)
+
+    datecodes = pd.Series(unique_datecodes[labels], index = dates.index)
+    gaps = pd.Series(unique_gaps[labels], index = dates.index)
+
+    return datecodes, gaps
+
+def computeDateFormats(datecodes):
+    """Converts a Date_code column into dates with US format (YYYY MM DD),
+    formatting each distinct date only once
+
+    Parameters:
+    -----------
+    datecodes : pandas Series
+        Date_code column of a dataset
+
+    Returns:
+    -----------
+        The dates with the corresponding format (pandas Series of str, None for missing datecodes)
+    """
+    labels, uniques = pd.factorize(datecodes)
+
+    formats = [str(int(code)) for code in uniques]
+    formats = np.array(
+                    [s[:4] + '/' + s[4:6] + '/' + s[6:8] for s in formats] + [None],
+                    dtype = object
+                    )
+
+    return pd.Series(formats[labels], index = datecodes.index)
+
 def computeSource(s):
     """Deletes the non digit leters of a word (used to identify 
         different sources of data in the dataset)
@@ -274,6 +483,415 @@ def computeSource(s):
 
     return s
 
+def seriesLabel(country, region, age, sex):
+    """Gives the 'Country - Region - Age - Gender' label of a series
+
+    Parameters:
+    -----------
+    country, region : str
+
+    age : int
+        first age of the age range
+
+    sex : str
+        'b', 'm' or 'f'
+
+    Returns:
+    -----------
+        The corresponding label (str)
+    """
+    label = (
+            str(country) + ' - ' 
+            + region + ' - ' 
+            + str(age) + '-' 
+            + str(age + (4 if age == 100 else 9))
+            + ' ans - ' + label_gender[sex]
+            )
+
+    return label
+
+def seriesLabels(series):
+    """Gives the 'Country - Region - Age - Gender' labels of a table of series
+
+    Parameters:
+    -----------
+    series : Pandas DataFrame
+        one row by series, with 'Country', 'Region', 'Age' and 'Sex' columns
+
+    Returns:
+    -----------
+        The corresponding labels (str list)
+    """
+    return [
+            seriesLabel(*keys_values) for keys_values in 
+            series[['Country', 'Region', 'Age', 'Sex']].itertuples(index = False)
+            ]
+
+def assignSeriesIds(df, series):
+    """Gives each row of the harmonised data the integer key of its series (Country, Region,
+    Age, Sex), adding the new series to the series table
+
+    Parameters:
+    -----------
+    df : Pandas DataFrame
+        the harmonised data
+
+    series : Pandas DataFrame
+        the series table : one row by series, with its 'series_id', keys and 'label'
+        (None if there is no series yet)
+
+    Returns:
+    -----------
+        series_ids : numpy array
+            the key of the series of each row
+
+        series : Pandas DataFrame
+            the updated series table
+    """
+    keys = ['Country', 'Region', 'Age', 'Sex']
+    keys_types = {'Country' : object, 'Region' : object, 'Age' : 'int64', 'Sex' : object}
+
+    if series is None:
+        series = pd.DataFrame(columns = ['series_id'] + keys + ['label'])
+
+    df_keys = df[keys].astype(keys_types)
+    series_keys = series[['series_id'] + keys].astype(keys_types)
+    df0 = df_keys.drop_duplicates().merge(series_keys, on = keys, how = 'left')
+
+    new_series = df0[df0['series_id'].isna()].copy()
+    first_id = int(series['series_id'].max()) + 1 if len(series) else 0
+    new_series['series_id'] = np.arange(first_id, first_id + len(new_series))
+    new_series['label'] = seriesLabels(new_series)
+
+    series = pd.concat([series, new_series], ignore_index = True)
+    series = series.astype({'series_id' : 'int32', 'Age' : 'int64'})
+
+    series_ids = df_keys.merge(
+                            series[['series_id'] + keys].astype(keys_types), 
+                            on = keys, 
+                            how = 'left'
+                            )['series_id'].to_numpy()
+
+    return series_ids, series
+
+def attachLabels(df, series):
+    """Joins the labels of the series to the rows of a dataset (for the legends of plots)
+
+    Parameters:
+    -----------
+    df : Pandas DataFrame
+        the dataset, with a 'series_id' column
+
+    series : Pandas DataFrame
+        the series table (see assignSeriesIds)
+
+    Returns:
+    -----------
+        df : Pandas DataFrame
+            the dataset with a 'Country - Region - Age - Gender' column
+    """
+    df = df.copy()
+    labels = pd.Series(series['label'].values, index = series['series_id'].values)
+    df['Country - Region - Age - Gender'] = df['series_id'].map(labels).astype(str)
+
+    return df
+
+def seriesManifest(df):
+    """Hashes the rows of each series (Country, Region, Age, Sex) of the harmonised data
+
+    Parameters:
+    -----------
+    df : Pandas DataFrame
+        the harmonised data (wide format, with 'Cases', 'Deaths' and 'Tests' columns)
+
+    Returns:
+    -----------
+        manifest : Pandas DataFrame
+            one row by series : its keys, its label, the hash and the number of its rows
+    """
+    keys = ['Country', 'Region', 'Age', 'Sex']
+    hashes = pd.util.hash_pandas_object(
+                                        df[keys + ['Date', 'Cases', 'Deaths', 'Tests']],
+                                        index = False
+                                        )
+
+    manifest = hashes.groupby(
+                            [df[key] for key in keys], 
+                            sort = False
+                            ).agg(['sum', 'size'])
+    manifest.columns = ['hash', 'rows']
+    manifest = manifest.reset_index()
+
+    manifest['Country - Region - Age - Gender'] = seriesLabels(manifest)
+
+    return manifest
+
+def changedSeries(old_manifest, new_manifest):
+    """Gives the labels of the series which are new or whose rows changed
+
+    Parameters:
+    -----------
+    old_manifest : Pandas DataFrame
+        the manifest of the already processed data (see seriesManifest)
+
+    new_manifest : Pandas DataFrame
+        the manifest of the new harmonised data
+
+    Returns:
+    -----------
+        The labels of the corresponding series (str list)
+    """
+    label = 'Country - Region - Age - Gender'
+    df0 = new_manifest.merge(
+                            old_manifest[[label, 'hash', 'rows']], 
+                            on = label, 
+                            how = 'left', 
+                            suffixes = ('', '_old')
+                            )
+
+    changed = (df0['hash'] != df0['hash_old']) | (df0['rows'] != df0['rows_old'])
+
+    return list(df0.loc[changed, label])
+
+def sort_series(df):
+    """Sorts a dataset by series, metric and date : the rows of each (series_id, Metric)
+    become a contiguous block, in date order (see series_offsets). Within a block, gap_in_day
+    is increasing and Date_code non decreasing (the rows of the time metrics keep the
+    Date_code of the row they are computed from, which comes before them).
+
+    Parameters:
+    -----------
+    df : Pandas DataFrame
+        the dataset
+
+    Returns:
+    -----------
+        df : Pandas DataFrame
+            the sorted dataset
+    """
+    return df.sort_values(by = ['series_id', 'Metric', 'gap_in_day'], kind = 'stable')
+
+def series_offsets(df):
+    """Gives the row range of each (series_id, Metric) block of a dataset whose blocks are
+    contiguous (see sort_series) : a boolean mask keeps the blocks contiguous, so the offsets
+    of a selection of the dataset are computed in one pass, without any sort
+
+    Parameters:
+    -----------
+    df : Pandas DataFrame
+        the dataset, with contiguous (series_id, Metric) blocks
+
+    Returns:
+    -----------
+        offsets : Pandas DataFrame
+            one row by block : its series_id, Metric, and first (start) and last + 1 (stop) rows
+    """
+    series_ids = df['series_id'].to_numpy()
+
+    if isinstance(df['Metric'].dtype, pd.CategoricalDtype):
+        metric_codes = df['Metric'].cat.codes.to_numpy()
+    else:
+        metric_codes, _ = pd.factorize(df['Metric'], sort = False)
+
+    change = np.flatnonzero(
+                        (series_ids[1:] != series_ids[:-1]) | (metric_codes[1:] != metric_codes[:-1])
+                            ) + 1
+    starts = np.concatenate([[0], change]) if len(df) else np.array([], dtype = np.int64)
+    stops = np.concatenate([change, [len(df)]]) if len(df) else np.array([], dtype = np.int64)
+
+    blocks = pd.MultiIndex.from_arrays([series_ids[starts], metric_codes[starts]])
+
+    if not blocks.is_unique:
+        raise ValueError('the (series_id, Metric) blocks of the dataset are not contiguous, see sort_series')
+
+    offsets = pd.DataFrame({
+                            'series_id' : series_ids[starts],
+                            'Metric' : df['Metric'].iloc[starts].to_numpy(),
+                            'start' : starts,
+                            'stop' : stops
+                            })
+
+    return offsets
+
+def series_slices(df, offsets = None):
+    """Iterates over the (series_id, Metric) blocks of a dataset, each block being a slice
+    of the dataset (no scan, no copy)
+
+    Parameters:
+    -----------
+    df : Pandas DataFrame
+        the dataset, with contiguous (series_id, Metric) blocks (see sort_series)
+
+    offsets : Pandas DataFrame
+        the offsets of the blocks (computed if not given, see series_offsets)
+
+    Returns:
+    -----------
+        slices : generator of (int, str, Pandas DataFrame)
+            the series_id, Metric and rows of each block
+    """
+    if offsets is None:
+        offsets = series_offsets(df)
+
+    for series_id, metric, start, stop in offsets.itertuples(index = False):
+        yield series_id, metric, df.iloc[start:stop]
+
+def latest_value_index(df, columns = ['Value', 'Value_by_pop']):
+    """Precomputes the lookup of the latest known value of every (series_id, Metric) block
+    of a dataset before any date (see latest_values) : for each row, the position of the
+    last non missing value of its block up to this row
+
+    Parameters:
+    -----------
+    df : Pandas DataFrame
+        the dataset (sorted by series, metric and date if its blocks are not, see sort_series)
+
+    columns : str list
+        the value columns to index
+
+    Returns:
+    -----------
+        index : dict
+            'blocks' : one row by block, its Country, Region, Age, Sex, Metric and first (start) row,
+            'keys' : gap_in_day shifted by block (increasing over the whole dataset),
+            'values' and 'last_valid' : by column, the values and the positions of the last
+            non missing value up to each row (-1 if none in the block),
+            'dates' : the Date_format of the rows
+    """
+    try:
+        offsets = series_offsets(df)
+    except ValueError:
+        df = sort_series(df)
+        offsets = series_offsets(df)
+
+    # gap_in_day (< 2**15) shifted by block : one binary search gives the rows of all the blocks
+    span = 2 ** 16
+
+    def block_keys(df, offsets):
+        lengths = (offsets['stop'] - offsets['start']).to_numpy()
+        block_starts = np.arange(len(offsets), dtype = np.int64) * span
+
+        return np.repeat(block_starts, lengths) + df['gap_in_day'].to_numpy(dtype = np.int64)
+
+    keys = block_keys(df, offsets)
+
+    # contiguous blocks not in date order : sorting may also reorder the blocks
+    if (np.diff(keys) < 0).any():
+        df = sort_series(df)
+        offsets = series_offsets(df)
+        keys = block_keys(df, offsets)
+
+    starts = offsets['start'].to_numpy()
+    lengths = (offsets['stop'] - offsets['start']).to_numpy()
+
+    row_starts = np.repeat(starts, lengths)
+    positions = np.arange(len(df))
+
+    values = {}
+    last_valid = {}
+
+    for column in columns:
+        values[column] = df[column].to_numpy(dtype = float)
+
+        # last non missing position up to each row, reset at the beginning of each block
+        valid_positions = np.maximum.accumulate(np.where(np.isnan(values[column]), -1, positions))
+        last_valid[column] = np.where(valid_positions >= row_starts, valid_positions, -1)
+
+    blocks = df[['Country', 'Region', 'Age', 'Sex', 'Metric']].iloc[starts].reset_index(drop = True)
+    blocks['start'] = starts
+
+    index = {
+            'blocks' : blocks,
+            'keys' : keys,
+            'span' : span,
+            'values' : values,
+            'last_valid' : last_valid,
+            'dates' : df['Date_format'].to_numpy(dtype = object)
+            }
+
+    return index
+
+def latest_values(index, metric, age, gender, end_date, column = 'Value', countries = None, regions = None):
+    """Gives the latest known value (last non missing value up to a date) of the series
+    of a metric, age range and gender, with one vectorized lookup (see latest_value_index)
+
+    Parameters:
+    -----------
+    index : dict
+        the lookup of a dataset (see latest_value_index)
+
+    metric : str
+        the metric to select
+
+    age : int
+        the age range to select
+
+    gender : str
+        the gender to select
+
+    end_date : int
+        the last date to be considered (gap_in_day)
+
+    column : str
+        the value column (an indexed one)
+
+    countries, regions : str list
+        the countries and regions to select (None for all of them)
+
+    Returns:
+    -----------
+        df : Pandas DataFrame
+            one row by region : its Country, Region, Value and Date_format (the value of the
+            first row if there is no known value, NaN and 'nan' if there is no row up to end_date) ;
+            when many series share a region (see fixRegions), the one with the latest known value,
+            the first one in the order of the dataset on a tie
+    """
+    blocks = index['blocks']
+    mask = (blocks['Metric'] == metric) & (blocks['Age'] == age) & (blocks['Sex'] == gender)
+
+    if countries is not None:
+        mask &= blocks['Country'].isin(countries)
+
+    if regions is not None:
+        mask &= blocks['Region'].isin(regions)
+
+    df = blocks[mask]
+    starts = df['start'].to_numpy()
+
+    # last row of each block up to end_date
+    rows = np.searchsorted(
+                        index['keys'],
+                        df.index.to_numpy(dtype = np.int64) * index['span'] + end_date,
+                        side = 'right'
+                        ) - 1
+    found = rows >= starts
+    rows = np.where(found, rows, starts)
+
+    # no known value : the first row of the block, as a backward search would give
+    valid_rows = index['last_valid'][column][rows]
+    rows = np.where(valid_rows >= 0, valid_rows, starts)
+
+    # gap_in_day of the latest known value, -1 if none
+    gaps = np.where(
+                found & (valid_rows >= 0),
+                index['keys'][rows] - df.index.to_numpy(dtype = np.int64) * index['span'],
+                -1
+                )
+
+    values = index['values'][column]
+    dates = index['dates']
+
+    df = df[['Country', 'Region']].reset_index(drop = True)
+
+    df['Value'] = np.where(found, values[rows], np.nan)
+    df['Date_format'] = np.where(found, dates[rows], 'nan')
+
+    # one series by region : the latest known value first, then the order of the dataset
+    order = np.argsort(-gaps, kind = 'stable')
+    df = df.iloc[order].drop_duplicates(['Country', 'Region']).sort_index()
+
+    return df.reset_index(drop = True)
+
 def select_data(df, countries_list, regions_list, ages_list, genders_list):
     """Extracts from the dataset the data corresponding to many criterias.
     Parameters:
@@ -304,6 +922,130 @@ def select_data(df, countries_list, regions_list, ages_list, genders_list):
         
     return df3
 
+# operators of the filters of the data table, each one with its spellings
+FILTER_OPERATORS = [
+                    ['ge ', '>='],
+                    ['le ', '<='],
+                    ['lt ', '<'],
+                    ['gt ', '>'],
+                    ['ne ', '!='],
+                    ['eq ', '='],
+                    ['contains '],
+                    ['datestartswith ']
+                    ]
+
+def splitFilterPart(filter_part):
+    """Parses a part of the filter query of a data table ('{column} operator value')
+
+    Parameters:
+    -----------
+    filter_part : str
+        a part of the filter query (the parts are separated by ' && ')
+
+    Returns:
+    -----------
+        name : str
+            the filtered column (None if the part is not understood)
+
+        operator : str
+            the operator (eq, ne, lt, le, gt, ge, contains or datestartswith)
+
+        value : float or str
+            the value compared to the column
+    """
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1 : name_part.rfind('}')]
+
+                value_part = value_part.strip()
+                v0 = value_part[:1]
+
+                if v0 and v0 == value_part[-1] and v0 in ("'", '"', '`'):
+                    value = value_part[1 : -1].replace('\\' + v0, v0)
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+
+                return name, operator_type[0].strip(), value
+
+    return None, None, None
+
+def table_page(df, page_current, page_size, sort_by = None, filter_query = ''):
+    """Gives a page of a data table, after filtering and sorting the whole selection :
+    only the rows of the page are sent to the browser
+
+    Parameters:
+    -----------
+    df : Pandas DataFrame
+        the selected data
+
+    page_current : int
+        the number of the page (from 0), the last page if there are fewer pages
+
+    page_size : int
+        the number of rows of a page
+
+    sort_by : dict list
+        the sorted columns ('column_id') and their 'direction' ('asc' or 'desc')
+
+    filter_query : str
+        the filters of the columns (see splitFilterPart)
+
+    Returns:
+    -----------
+        records : dict list
+            the rows of the page
+
+        page_count : int
+            the number of pages
+
+        page_current : int
+            the number of the given page
+    """
+    if filter_query:
+        mask = np.ones(len(df), dtype = bool)
+
+        for filter_part in filter_query.split(' && '):
+            name, operator, value = splitFilterPart(filter_part)
+
+            if name not in df.columns:
+                continue
+
+            column = df[name]
+
+            if operator in ['eq', 'ne', 'lt', 'le', 'gt', 'ge']:
+                # labels are compared as strings, numbers as numbers
+                if isinstance(column.dtype, pd.CategoricalDtype) or isinstance(value, str):
+                    column = column.astype(str)
+                    value = str(value)
+
+                mask &= getattr(column, operator)(value).to_numpy()
+
+            elif operator == 'contains':
+                mask &= column.astype(str).str.contains(str(value), regex = False).to_numpy()
+
+            elif operator == 'datestartswith':
+                mask &= column.astype(str).str.startswith(str(value)).to_numpy()
+
+        df = df[mask]
+
+    if sort_by:
+        df = df.sort_values(
+                            by = [col['column_id'] for col in sort_by],
+                            ascending = [col['direction'] == 'asc' for col in sort_by],
+                            kind = 'stable'
+                            )
+
+    page_count = max(1, -(-len(df) // page_size))
+    page_current = min(page_current, page_count - 1)
+    page = df.iloc[page_current * page_size : (page_current + 1) * page_size]
+
+    return page.to_dict('records'), page_count, page_current
+
 def regions_of_country(df, list_of_countries):
     """Gives the list of the regions of a list of countries
 
@@ -353,224 +1095,337 @@ def meltDataframe(df):
             The coresponding dataframe
     """
     df_long = df.melt(
-            id_vars = ['Date', 'Sex', 'Country', 'Region', 'Age', 'Date_code'],
+            id_vars = ['Date', 'Sex', 'Country', 'Region', 'Age', 'series_id', 'Date_code', 'gap_in_day'],
             var_name = 'Metric',
             value_name = 'Value',
-            value_vars = ['Cases', 'Deaths', 'Tests', 'CFR', 'Tests by cases']
+            value_vars = [metric for metric in ['Cases', 'Deaths', 'Tests', 'CFR', 'Tests by cases']
+                            if metric in df.columns]
                     )
 
     df_long = df_long[df_long['Value'] > 0.001]
 
     return df_long
 
-def compute_daily_metrics(df, metric):
-    """Computes daily metrics from cumulative ones and inserts it in data frame in 'Metric' column
+def append_rows(df, new_rows):
+    """Appends rows at the end of a dataframe, numbering the index as successive
+    'df.loc[-1] = row ; df.index = df.index + 1' insertions would do
 
     Parameters:
     -----------
     df : Pandas DataFrame
         the original dataset
 
-    metric : the cumulative metric to use for computing daily one
+    new_rows : Pandas DataFrame
+        the rows to append (same columns as df)
 
     Returns
     -----------
         df : Pandas Dataframe
         the correspunding dataframe
     """
-    df0 = df[df['Metric'] == metric]
-    new_metric = 'Daily ' + metric
-    identities = list(
-                        set(
-                            df0['Country - Region - Age - Gender'].values
-                            )
-                    )
+    n = len(new_rows)
 
-    for ide in identities:
-        print(ide)
-        df1 = df0[df0['Country - Region - Age - Gender'] == ide]
-        L = [(index, row) for index, row in df1.iterrows()]
+    if n == 0:
+        return df
 
-        new_rows_list = []
+    df = df.copy()
+    df.index = df.index + n
+    new_rows = new_rows.copy()
+    new_rows.index = np.arange(n - 1, -1, -1)
 
-        for row_number in range(len(L) - 1):
-            row0 = L[row_number][1]
-            row1 = L[row_number+1][1]
+    return pd.concat([df, new_rows])
 
-            for j in range(row0.gap_in_day + 1, row1.gap_in_day + 1):
-                new_row = row0.copy()
-                new_row.gap_in_day = j
-                new_row.Metric = new_metric
+def group_series(df):
+    """Makes the rows of each series (same 'series_id') contiguous,
+    keeping their order in the dataset
 
-                try:
-                    new_row.Value = int(
-                                        100 * (row1.Value - row0.Value) / (row1.gap_in_day - row0.gap_in_day)
-                                        ) / 100
+    Parameters:
+    -----------
+    df : Pandas DataFrame
+        the original dataset
 
-                except ZeroDivisionError:
-                    new_row.Value = None
+    Returns
+    -----------
+        df : Pandas DataFrame
+            the reordered dataset
 
-                new_rows_list.append(new_row)
-                    
-        for i in range(len(new_rows_list)):
-            new_row = new_rows_list[i]
-            df.loc[-1] = new_row
-            df.index = df.index + 1
+        codes : numpy array
+            the series number of each row (ascending)
+    """
+    codes, _ = pd.factorize(df['series_id'], sort = False)
+    order = np.argsort(codes, kind = 'stable')
 
-    print('daily metric computed')
-    return df
+    return df.iloc[order], codes[order]
 
-def start_first_monday(df):
-    """Slices the dataset keeping data dated after the first monday available
+def daily_arrays(codes, gaps, values):
+    """Spreads the differences between consecutive cumulative values of each series
+    evenly over the days between them
 
     Parameters:
     -----------
-    df : Pandas DataFrame
-        the original dataset
+    codes : numpy array
+        the series number of each row (rows of a series contiguous)
+
+    gaps : numpy array
+        the gap_in_day of each row
+
+    values : numpy array
+        the cumulative value of each row
 
     Returns
     -----------
-        df : Pandas DataFrame
-            the corresponding dataset
+        source : numpy array
+            for each daily value, the row it is computed from
+
+        daily_gaps : numpy array
+            the gap_in_day of each daily value
+
+        daily_values : numpy array
+            the daily values
     """
+    # consecutive pairs (row0, row1) of a same series
+    row0 = np.flatnonzero(codes[:-1] == codes[1:])
+    row1 = row0 + 1
+    days = gaps[row1] - gaps[row0]
+    row0, row1, days = row0[days > 0], row1[days > 0], days[days > 0]
 
-    first_date_gap = df.iloc[0].gap_in_day
-    next_monday_gap = first_date_gap + (4 - first_date_gap % 7) % 7
-    
-    df0 = df[df['gap_in_day'] >= next_monday_gap]
+    values_by_day = np.trunc(
+                            100 * (values[row1] - values[row0]) / days
+                            ) / 100
 
-    return df0
+    # one daily value for each day of ]gap0, gap1]
+    source = np.repeat(row0, days)
+    first_of_pair = np.cumsum(days) - days
+    offsets = np.arange(len(source)) - np.repeat(first_of_pair, days) + 1
+
+    return source, gaps[source] + offsets, np.repeat(values_by_day, days)
 
-def compute_weekly_metrics(df, metric):
-    """Computes weekly metrics from daily ones and inserts it in data frame in 'Metric' column
+def compute_daily_metrics(df, metric):
+    """Computes daily metrics from cumulative ones and inserts it in data frame in 'Metric' column
+
+    The difference between two consecutive values of a same series (same 'series_id')
+    is spread evenly over the days between them.
 
     Parameters:
     -----------
     df : Pandas DataFrame
         the original dataset
 
-    metric : the metric to use for computing weekly one
+    metric : the cumulative metric to use for computing daily one
 
     Returns
     -----------
         df : Pandas Dataframe
         the correspunding dataframe
     """
-    df0 = df[df['Metric'] == 'Daily ' + metric]
-    new_metric = 'Weekly ' + metric
-    identities = list(
-                    set(
-                        df0['Country - Region - Age - Gender'].values
-                        )
-                    )
+    df0 = df[df['Metric'] == metric]
+    df0, codes = group_series(df0)
 
-    for ide in identities:
-        df1 = df0[df0['Country - Region - Age - Gender'] == ide]
-        df1 = start_first_monday(df1)
-        L = [row for _, row in df1.iterrows()][1:]
-
-        for i in range((len(L) - 1) // 7):
-            value = sum([row.Value for row in L[7 * i: 7 * i + 7]])
-            
-            for j in range(7 * i + 1, 7 * i + 8):
-
-                if j % 7 == 0:
-                    row = L[j]
-                    new_row = row.copy()
-                    new_row['gap_in_day', 'Metric', 'Value'] = row.gap_in_day, new_metric, value
-                        
-                    df.loc[-1] = new_row
-                    df.index = df.index + 1
-                else:
-                    pass
+    source, daily_gaps, daily_values = daily_arrays(
+                                    codes,
+                                    df0['gap_in_day'].to_numpy(dtype = np.int64),
+                                    df0['Value'].to_numpy(dtype = np.float64)
+                                                    )
 
-    print('weekly metric computed')
-    return df
+    print('daily metric computed')
+    return append_rows(df, daily_rows(df0, metric, source, daily_gaps, daily_values))
 
-def compute_biweekly_metrics(df, metric):
-    """Computes biweekly metrics (14 days) from daily ones and inserts it in data frame in 'Metric' column
+def daily_rows(df, metric, source, daily_gaps, daily_values):
+    """Builds the rows of a daily metric from the results of daily_arrays
 
     Parameters:
     -----------
     df : Pandas DataFrame
-        the original dataset
+        the rows of the cumulative metric, grouped by series (see group_series)
+
+    metric : str
+        the cumulative metric
 
-    metric : the metric to use for computing biweekly one
+    source, daily_gaps, daily_values : numpy arrays
+        see daily_arrays
 
     Returns
     -----------
-        df : Pandas Dataframe
-        the correspunding dataframe
+        new_rows : Pandas DataFrame
+            the rows of the daily metric
     """
-    df0 = df[df['Metric'] == 'Daily ' + metric]
-    new_metric = 'Biweekly ' + metric
-    identities = list(
-                    set(
-                        df0['Country - Region - Age - Gender'].values
-                        )
+    new_rows = df.iloc[source].copy()
+    new_rows['gap_in_day'] = daily_gaps
+    new_rows['Metric'] = 'Daily ' + metric
+    new_rows['Value'] = daily_values
+
+    return new_rows
+
+def aggregate_periods(codes, gaps, values, period_end, length, label_gap):
+    """Sums daily values over periods
+
+    Parameters:
+    -----------
+    codes : numpy array
+        the series number of each daily row (rows of a series contiguous)
+
+    gaps : numpy array
+        the gap_in_day of each daily row
+
+    values : numpy array
+        the daily value of each row
+
+    period_end : numpy array
+        for each row, the gap_in_day of the last day of its period
+
+    length : numpy array
+        for each row, the number of days of its period
+
+    label_gap : numpy array
+        for each row, the gap_in_day of the row labelling its period
+
+    Returns
+    -----------
+        label_rows : numpy array
+            for each complete period, the row labelling it
+
+        sums : numpy array
+            for each complete period, the sum of its daily values
+    """
+    if len(codes) == 0:
+        return np.zeros(0, dtype = np.int64), np.zeros(0)
+
+    # index of the rows by (series, gap_in_day)
+    span = int(max(gaps.max(), label_gap.max(), period_end.max()) - gaps.min()) + 1
+    row_keys = codes * span + (gaps - gaps.min())
+    unique_keys, first_rows = np.unique(row_keys, return_index = True)
+
+    periods, inverse = np.unique(
+                                codes * span + (period_end - gaps.min()),
+                                return_inverse = True
+                                )
+    sums = np.bincount(inverse, weights = values)
+    counts = np.bincount(inverse)
+
+    first_of_period = np.unique(inverse, return_index = True)[1]
+    label_keys = (codes * span + (label_gap - gaps.min()))[first_of_period]
+
+    position = np.searchsorted(unique_keys, label_keys)
+    position[position == len(unique_keys)] = 0
+    complete = (counts == length[first_of_period]) & (unique_keys[position] == label_keys)
+
+    return first_rows[position[complete]], sums[complete]
+
+def resampled_arrays(codes, gaps, values):
+    """Sums daily values by week, fortnight and month
+
+    Weeks and fortnights of a series start the day after its first sunday, and are labelled
+    by the day after their end. Months follow the calendar, and are labelled by their last day.
+    Only complete periods are kept.
+
+    Parameters:
+    -----------
+    codes : numpy array
+        the series number of each daily row (rows of a series contiguous)
+
+    gaps : numpy array
+        the gap_in_day of each daily row
+
+    values : numpy array
+        the daily value of each row
+
+    Returns
+    -----------
+        periods : (numpy array, numpy array) list
+            for weeks, fortnights and months : the rows labelling the complete periods,
+            and the sums of their daily values (see aggregate_periods)
+    """
+    periods = []
+
+    if len(codes) == 0:
+        return [aggregate_periods(codes, gaps, values, gaps, gaps, gaps) for i in range(3)]
+
+    series_start = np.r_[True, codes[1:] != codes[:-1]]
+    first_gaps = gaps[series_start][np.cumsum(series_start) - 1]
+    first_sundays = first_gaps + (4 - first_gaps % 7) % 7
+
+    for period in [7, 14]:
+        in_period = np.flatnonzero(gaps > first_sundays)
+        period_end = first_sundays + period * ((gaps - first_sundays - 1) // period + 1)
+
+        label_rows, sums = aggregate_periods(
+                                            codes[in_period],
+                                            gaps[in_period],
+                                            values[in_period],
+                                            period_end[in_period],
+                                            np.full(len(in_period), period),
+                                            period_end[in_period] + 1
+                                            )
+        periods.append((in_period[label_rows], sums))
+
+    # the daily value of a day is the growth since the day before : a month gathers
+    # the days from its 2nd day to the 1st day of the following month
+    origin = np.datetime64(first_day, 'D')
+    months = (origin + gaps - 1).astype('datetime64[M]')
+    first_days = (months.astype('datetime64[D]') - origin).astype(np.int64)
+    next_first_days = ((months + 1).astype('datetime64[D]') - origin).astype(np.int64)
+
+    periods.append(
+                    aggregate_periods(
+                                    codes,
+                                    gaps,
+                                    values,
+                                    next_first_days,
+                                    next_first_days - first_days,
+                                    next_first_days - 1
+                                    )
                     )
 
-    for ide in identities:
-        df1 = df0[df0['Country - Region - Age - Gender'] == ide]
-        df1 = start_first_monday(df1)
-
-        L = [row for _, row in df1.iterrows()][1:]
-
-        for i in range((len(L) - 1) // 14):
-            value = sum([row.Value for row in L[14 * i: 14 * i + 14]])
-            
-            for j in range(14 * i + 1, 14 * i + 15):
-                if j % 14 == 0:
-                    row = L[j]
-                    new_row = row.copy()
-                    new_row['gap_in_day', 'Metric', 'Value'] = row.gap_in_day, new_metric, value
-                        
-                    df.loc[-1] = new_row
-                    df.index = df.index + 1
-
-    print('biweekly metric computed')
-    return df
+    return periods
 
-def start_first_of_the_month(df):
-    """Slices the dataset keeping data dated after the first available first day of the month
-    and before the last avaible first day of the month
+def resampled_rows(df, metric, periods, intervals = ['Weekly ', 'Biweekly ', 'Monthly ']):
+    """Builds the rows of weekly, biweekly and monthly metrics from the results of resampled_arrays
 
     Parameters:
     -----------
     df : Pandas DataFrame
-        the original dataset
+        the rows of the daily metric, grouped by series (see group_series)
+
+    metric : str
+        the cumulative metric
+
+    periods : (numpy array, numpy array) list
+        see resampled_arrays
+
+    intervals : str list
+        the time intervals to build (among 'Weekly ', 'Biweekly ' and 'Monthly ')
 
     Returns
     -----------
-        df : Pandas DataFrame
-            the corresponding dataset
+        new_rows : Pandas DataFrame
+            the rows of the weekly, biweekly and monthly metrics
     """
-    first_date_gap = df.iloc[0].gap_in_day
-    try:
-        first_of_month_gap = min([i - 1 for i in firsts_of_the_month if i - 1 >= first_date_gap])
-    except:
-        return df
+    new_rows_list = [df.iloc[:0]]
 
-    last_date_gap = df.iloc[-1].gap_in_day
-    try:
-        last_of_month_gap = min([i - 1 for i in firsts_of_the_month if i >= last_date_gap])
-    except:
-        return df
+    for interval, (label_rows, sums) in zip(['Weekly ', 'Biweekly ', 'Monthly '], periods):
+        if interval not in intervals:
+            continue
 
-    df = df[df['gap_in_day'] >= first_of_month_gap]
-    df = df[df['gap_in_day'] <= last_of_month_gap]
+        new_rows = df.iloc[label_rows].copy()
+        new_rows['Metric'] = interval + metric
+        new_rows['Value'] = sums
 
-    return df
+        if interval == 'Monthly ':
+            new_rows['Date_code'] = datecodesFromGaps(new_rows['gap_in_day'].to_numpy())
 
-def compute_monthly_metrics(df, metric):
-    """Computes monthly metrics from daily ones and inserts it in data frame in 'Metric' column
+        new_rows_list.append(new_rows)
+
+    return pd.concat(new_rows_list)
+
+def compute_resampled_metrics(df, metric):
+    """Computes weekly, biweekly and monthly metrics from daily ones and inserts it in data frame in 'Metric' column
 
     Parameters:
     -----------
     df : Pandas DataFrame
         the original dataset
 
-    metric : the metric to use for computing monthly one
+    metric : the metric to use for computing weekly, biweekly and monthly ones
 
     Returns
     -----------
@@ -578,48 +1433,68 @@ def compute_monthly_metrics(df, metric):
         the correspunding dataframe
     """
     df0 = df[df['Metric'] == 'Daily ' + metric]
-    new_metric = 'Monthly ' + metric
-    identities = list(
-                    set(
-                        df0['Country - Region - Age - Gender'].values
-                        )
-                    )
+    df0, codes = group_series(df0)
 
-    for ide in identities:
-        df1 = df0[df0['Country - Region - Age - Gender'] == ide]
-        df1 = start_first_of_the_month(df1)
-        checkpoint = 0
-        L = [row for _, row in df1.iterrows()][1:]
+    periods = resampled_arrays(
+                                codes,
+                                df0['gap_in_day'].to_numpy(dtype = np.int64),
+                                df0['Value'].to_numpy(dtype = np.float64)
+                                )
 
-        try:
-            first_month_number = firsts_of_the_month.index(L[0].gap_in_day)
-        except IndexError:
-            continue
+    print('weekly, biweekly and monthly metrics computed')
+    return append_rows(df, resampled_rows(df0, metric, periods))
 
-        for i in range((len(L) - 1) // 30):
-            month_number = first_month_number + i
-            month_length = firsts_of_the_month[month_number + 1] - firsts_of_the_month[month_number]
-            
-            value = sum([row.Value for row in L[checkpoint: checkpoint + month_length]])
+def time_metrics_arrays(payload):
+    """Computes daily, weekly, biweekly and monthly values of some series
+    (function run by the workers of build_time_metrics)
 
-            checkpoint+= month_length
+    Parameters:
+    -----------
+    payload : (numpy array, numpy array, numpy array)
+        codes, gaps and cumulative values of the rows of the series (see daily_arrays)
 
-            row = L[checkpoint-2]
-            new_row = row.copy()
-            new_row[
-                'gap_in_day', 
-                'Date_code', 
-                'Metric', 
-                'Value'
-                    ] = row.gap_in_day, computeDatecodeFromGap(row.gap_in_day),new_metric, value                  
+    Returns
+    -----------
+        daily : (numpy array, numpy array, numpy array)
+            see daily_arrays
 
-            df.loc[-1] = new_row
-            df.index = df.index + 1
+        periods : (numpy array, numpy array) list
+            see resampled_arrays (rows are those of the daily values)
+    """
+    codes, gaps, values = payload
+    source, daily_gaps, daily_values = daily_arrays(codes, gaps, values)
+    periods = resampled_arrays(codes[source], daily_gaps, daily_values)
 
-    print('monthly metric computed')
-    return df
+    return (source, daily_gaps, daily_values), periods
+
+def shard_series(codes, shards_number):
+    """Splits rows into contiguous shards of whole series, of similar sizes
+
+    Parameters:
+    -----------
+    codes : numpy array
+        the series number of each row (ascending)
+
+    shards_number : int
+        the wanted number of shards
+
+    Returns
+    -----------
+        bounds : int list
+            the first row of each shard, and the number of rows
+    """
+    if len(codes) == 0:
+        return [0, 0]
+
+    series_starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    targets = np.linspace(0, len(codes), shards_number + 1)[1:-1]
+    cuts = np.r_[series_starts, len(codes)][np.searchsorted(series_starts, targets)]
+
+    bounds = sorted(set([0, len(codes)] + [int(cut) for cut in cuts]))
 
-def build_time_metrics(df):
+    return bounds
+
+def build_time_metrics(df, workers = 1, intervals = ['Daily ', 'Weekly ', 'Biweekly ', 'Monthly ']):
     """Builds time metrics from dataframe containing cumulative metrics
 
     Parameters:
@@ -627,26 +1502,266 @@ def build_time_metrics(df):
     df : Pandas DataFrame
         the original dataset (assumed to have one 'Metric' column (long format))
 
+    workers : int
+        number of processes among which series are shared (1 : no parallelism),
+        the result does not depend on it
+
+    intervals : str list
+        the time intervals to build (among 'Daily ', 'Weekly ', 'Biweekly ' and 'Monthly ')
+
     Returns
     -----------
         df : Pandas dataframe
             the corresponding dataframe with the new metrics (long format)
     """
-    for metric in ['Deaths', 'Cases', 'Tests']:
-        df = compute_daily_metrics(df, metric)
-        df = compute_weekly_metrics(df, metric)
-        df = compute_biweekly_metrics(df, metric)
-        df = compute_monthly_metrics(df, metric)
+    if len(intervals) == 0:
+        return df
+
+    if workers > 1:
+        if 'fork' in get_all_start_methods():
+            pool = ProcessPoolExecutor(workers, mp_context = get_context('fork'))
+        else:
+            pool = ProcessPoolExecutor(workers)
+    else:
+        pool = None
+
+    # the processes are stopped even if a shard fails
+    try:
+        for metric in ['Deaths', 'Cases', 'Tests']:
+            df0 = df[df['Metric'] == metric]
+            df0, codes = group_series(df0)
+            gaps = df0['gap_in_day'].to_numpy(dtype = np.int64)
+            values = df0['Value'].to_numpy(dtype = np.float64)
+
+            bounds = shard_series(codes, 4 * workers if pool else 1)
+            payloads = [
+                        (codes[start:end], gaps[start:end], values[start:end]) 
+                        for start, end in zip(bounds[:-1], bounds[1:])
+                        ]
+
+            if pool:
+                results = list(pool.map(time_metrics_arrays, payloads))
+            else:
+                results = [time_metrics_arrays(payload) for payload in payloads]
+
+            # gathering of the shards, in order : rows numbers made global
+            daily_offsets = np.cumsum([0] + [len(daily[0]) for daily, _ in results])
+
+            source = np.concatenate([daily[0] + start for (daily, _), start in zip(results, bounds)])
+            daily_gaps = np.concatenate([daily[1] for daily, _ in results])
+            daily_values = np.concatenate([daily[2] for daily, _ in results])
+
+            periods = []
+            for i in range(3):
+                label_rows = np.concatenate(
+                        [periods_list[i][0] + offset for (_, periods_list), offset in zip(results, daily_offsets)]
+                                            )
+                sums = np.concatenate([periods_list[i][1] for _, periods_list in results])
+                periods.append((label_rows, sums))
+
+            df_daily = daily_rows(df0, metric, source, daily_gaps, daily_values)
+
+            if 'Daily ' in intervals:
+                df = append_rows(df, df_daily)
+                print('daily metric computed')
+
+            df = append_rows(df, resampled_rows(df_daily, metric, periods, intervals))
+            print('weekly, biweekly and monthly metrics computed')
+
+    finally:
+        if pool:
+            pool.shutdown()
 
     return df
 
-def regression(df, degree, forecast, by_pop):
-    """Computes polynomal regressions on plotted data
+def lttb_rows(x, y, lengths, threshold):
+    """Downsamples series with the Largest-Triangle-Three-Buckets algorithm, all the series
+    at once : each series longer than threshold is cut into threshold - 2 buckets (plus its
+    first and last points), and the point of each bucket forming the largest triangle with
+    the point kept in the previous bucket and the mean of the next bucket is kept, so that
+    the peaks stay visible. The missing values of the downsampled series (not plotted)
+    are not kept.
+
+    Parameters:
+    -----------
+    x, y : numpy arrays
+        the points of all the series, each series in x order
+
+    lengths : int numpy array
+        the number of rows of each series (consecutive rows)
+
+    threshold : int
+        the maximal number of points of a series (at least 3)
+
+    Returns:
+    -----------
+        rows : int numpy array
+            the positions of the kept rows, in increasing order
+    """
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    blocks = np.repeat(np.arange(len(lengths)), lengths)
+    finite = np.isfinite(y)
+    finite_counts = np.bincount(blocks[finite], minlength = len(lengths))
+
+    # the series with at most threshold points to plot are kept whole
+    whole = finite_counts <= threshold
+    kept = [np.arange(start, start + length) for start, length in zip(starts[whole], lengths[whole])]
+
+    # the finite points of the other series
+    positions = np.flatnonzero(finite & ~whole[blocks])
+    n = finite_counts[~whole]
+    starts = np.concatenate([[0], np.cumsum(n)[:-1]]).astype(np.int64)
+
+    if len(n):
+        px, py = x[positions].astype(float), y[positions].astype(float)
+        cx = np.concatenate([[0], np.cumsum(px)])
+        cy = np.concatenate([[0], np.cumsum(py)])
+
+        every = (n - 2) / (threshold - 2)
+        a = starts.copy()
+        selected = [starts]
+
+        for i in range(threshold - 2):
+            # mean of the next bucket (the last point for the last bucket)
+            avg_start = starts + np.floor((i + 1) * every).astype(np.int64) + 1
+            avg_end = np.minimum(starts + np.floor((i + 2) * every).astype(np.int64) + 1, starts + n)
+            avg_x = (cx[avg_end] - cx[avg_start]) / (avg_end - avg_start)
+            avg_y = (cy[avg_end] - cy[avg_start]) / (avg_end - avg_start)
+
+            # points of the current bucket of every series
+            bucket_start = starts + np.floor(i * every).astype(np.int64) + 1
+            bucket_end = starts + np.floor((i + 1) * every).astype(np.int64) + 1
+            sizes = bucket_end - bucket_start
+            segments = np.repeat(np.arange(len(n)), sizes)
+            candidates = np.arange(sizes.sum()) + np.repeat(bucket_start - (np.cumsum(sizes) - sizes), sizes)
+
+            areas = np.abs(
+                        (px[a] - avg_x)[segments] * (py[candidates] - py[a][segments])
+                        - (px[a][segments] - px[candidates]) * (avg_y - py[a])[segments]
+                        )
+
+            # the largest triangle of each bucket (the first one if several)
+            order = np.lexsort((-areas, segments))
+            a = candidates[order[np.concatenate([[0], np.cumsum(sizes)[:-1]])]]
+            selected.append(a)
+
+        selected.append(starts + n - 1)
+        kept.append(positions[np.concatenate(selected)])
+
+    if not kept:
+        return np.array([], dtype = np.int64)
+
+    return np.sort(np.concatenate(kept))
+
+def polynomial_features(x, degree):
+    """Gives the powers 0 to degree of some values (as PolynomialFeatures of scikit-learn)
+
+    Parameters:
+    -----------
+    x : numpy array
+        the values
+
+    degree : int
+        the degree of the polynomials
+
+    Returns:
+    -----------
+        features : numpy array
+            the powers of the values, in a last axis of size degree + 1
+    """
+    return np.asarray(x, dtype = float)[..., np.newaxis] ** np.arange(degree + 1)
+
+def ridge_polynomials(x, y, lengths, degree, alpha = 1.0):
+    """Fits polynomial ridge regressions on blocks of consecutive rows, solving all the
+    systems at once. Each fit is the one of make_pipeline(PolynomialFeatures(degree), Ridge(alpha))
+    of scikit-learn (centered normal equations, unpenalized intercept). Missing (or infinite)
+    values of y are not fitted.
+
+    Parameters:
+    -----------
+    x, y : numpy arrays
+        the points of all the blocks
+
+    lengths : int numpy array
+        the number of rows of each block (all positive)
+
+    degree : int
+        degree of the polynomial regressions
+
+    alpha : float
+        regularization strength
+
+    Returns:
+    -----------
+        coefs : numpy array
+            the coefficients of the powers 0 to degree of each block (one row by block)
+
+        intercepts : numpy array
+            the intercept of each block (NaN if the block has no value)
+    """
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    blocks = np.repeat(np.arange(len(lengths)), lengths)
+
+    valid = np.isfinite(y)
+    weights = valid.astype(float)
+
+    # the blocks without any value are fitted on no point (their intercept is set to NaN)
+    counts = np.maximum(np.add.reduceat(weights, starts), 1)
+
+    features = polynomial_features(x, degree)
+    features_means = np.add.reduceat(features * weights[:, np.newaxis], starts) / counts[:, np.newaxis]
+    y_means = np.add.reduceat(np.where(valid, y, 0), starts) / counts
+
+    # centered features and values, the missing values being left out
+    centered = (features - features_means[blocks]) * weights[:, np.newaxis]
+    y_centered = np.where(valid, y - y_means[blocks], 0)
+
+    # (centered features)^T (centered features) + alpha Id, block by block
+    gram = np.empty((len(lengths), degree + 1, degree + 1))
+
+    for i in range(degree + 1):
+        gram[:, i, :] = np.add.reduceat(centered * centered[:, i:i + 1], starts)
+
+    gram += alpha * np.eye(degree + 1)
+    products = np.add.reduceat(centered * y_centered[:, np.newaxis], starts)
+
+    coefs = np.linalg.solve(gram, products[..., np.newaxis])[..., 0]
+    intercepts = y_means - (features_means * coefs).sum(axis = 1)
+    intercepts[~np.logical_or.reduceat(valid, starts)] = np.nan
+
+    return coefs, intercepts
+
+def predict_polynomials(coefs, intercepts, x):
+    """Evaluates polynomials (see ridge_polynomials) on points
+
+    Parameters:
+    -----------
+    coefs : numpy array
+        the coefficients of the polynomials (one row by polynomial)
+
+    intercepts : numpy array
+        the intercepts of the polynomials
+
+    x : numpy array
+        the points where to evaluate each polynomial (one row by polynomial)
+
+    Returns:
+    -----------
+        y : numpy array
+            the values of the polynomials (one row by polynomial)
+    """
+    degree = coefs.shape[1] - 1
+
+    return np.einsum('bnk,bk->bn', polynomial_features(x, degree), coefs) + intercepts[:, np.newaxis]
+
+def regression(df, degree, forecast, by_pop, cache = None):
+    """Computes polynomal regressions on plotted data, all the series at once
 
     Parameters:
     -----------
     df : Pandas DataFrame
-        the dataset, assumed to be have one 'Metric' column
+        the dataset, assumed to be have one 'Metric' column, with contiguous
+        (series_id, Metric) blocks (see sort_series)
 
     degree: int
         degree of the polynomial regression
@@ -657,11 +1772,16 @@ def regression(df, degree, forecast, by_pop):
     by_pop : bool
         if true, consider values py millions inhabitants 
         else consider gross values 
+
+    cache : src.cache.LRUCache
+        the cache of the regressions (validated for the version of the dataset),
+        only the series which are not cached are fitted (None for no cache)
     
     Returns:
     -----------
         regressons_list : (numpy array, numpy array) list
             the list of the several modelizations got by regression
+            (none for the series without any value)
     """
 
     if by_pop :
@@ -669,50 +1789,62 @@ def regression(df, degree, forecast, by_pop):
     else:
         V = 'Value'
 
-    metrics = list(
-                    set(
-                        df['Metric'].values
-                        )
-                )
+    if df.empty:
+        return []
 
-    regressions_list = []
+    # one regression by series and metric : each one is a block of the dataset
+    offsets = series_offsets(df)
+    lengths = (offsets['stop'] - offsets['start']).to_numpy()
+    starts = offsets['start'].to_numpy()
 
-    for metric in metrics:
-        df0 = df[df['Metric'] == metric]
-        identities = list(
-                         set(
-                            df0['Country - Region - Age - Gender'].values
-                            )
-                         )
+    x = df['gap_in_day'].to_numpy(dtype = float)
+    first_gaps = np.minimum.reduceat(x, starts)
+    last_gaps = np.maximum.reduceat(x, starts)
 
-        for ide in identities:
-            df1 = df0[df0['Country - Region - Age - Gender'] == ide]
+    # the rows of a block are the ones of its series between its first and last dates
+    keys = [
+            (series_id, metric, first_gap, last_gap, degree, forecast, by_pop)
+            for series_id, metric, first_gap, last_gap
+            in zip(offsets['series_id'], offsets['Metric'], first_gaps, last_gaps)
+            ]
 
-            x = np.array(
-                    df1['gap_in_day']
-                        )
-            y = np.array(
-                    df1[V]
-                        )
-            X = x[:, np.newaxis]
-
-            model = make_pipeline(
-                                PolynomialFeatures(degree),     
-                                Ridge()
+    if cache is None:
+        curves = [None for key in keys]
+        missing = np.arange(len(keys))
+    else:
+        curves = [cache.get(key) for key in keys]
+        missing = np.array([i for i, curve in enumerate(curves) if curve is None], dtype = np.int64)
+
+    if len(missing):
+        # rows of the blocks to fit
+        rows = np.arange(lengths[missing].sum()) + np.repeat(
+                                starts[missing] - (np.cumsum(lengths[missing]) - lengths[missing]),
+                                lengths[missing]
                                 )
 
-            model.fit(X, y)
+        coefs, intercepts = ridge_polynomials(
+                                            x[rows],
+                                            df[V].to_numpy(dtype = float)[rows],
+                                            lengths[missing],
+                                            degree
+                                            )
+
+        x_plot = np.linspace(
+                        first_gaps[missing],
+                        last_gaps[missing] + forecast,
+                        1000,
+                        axis = 1
+                            )
+        y_plot = predict_polynomials(coefs, intercepts, x_plot)
+
+        for j, i in enumerate(missing):
+            # a series without any value has no curve
+            curves[i] = (x_plot[j], y_plot[j]) if not np.isnan(intercepts[j]) else ()
 
-            x_plot = np.linspace(
-                            min(x),
-                            max(df1['gap_in_day']) + forecast,
-                            1000
-                                )
-            X_plot = x_plot[:, np.newaxis]
+            if cache is not None:
+                cache.put(keys[i], curves[i])
 
-            regressions_list.append(
-                                (x_plot, model.predict(X_plot))
-                                    )
+    regressions_list = [curve for curve in curves if len(curve)]
 
     return regressions_list
 
@@ -732,28 +1864,17 @@ def regression_histogram(df, degree):
         X, Y : numpy arrays
             the model got by regression
     """
-    x = np.array(
-            df['Age']
-                )
-    y = np.array(
-            df['Value']
-                )
-
-    X = x[:, np.newaxis]
+    x = df['Age'].to_numpy(dtype = float)
+    y = df['Value'].to_numpy(dtype = float)
 
-    model = make_pipeline(
-                    PolynomialFeatures(degree), 
-                    Ridge()
-                        )
-    model.fit(X, y)
+    coefs, intercepts = ridge_polynomials(x, y, np.array([len(x)]), degree)
 
     x_plot = np.linspace(
                         min(x),
                         max(x),
                         1000
                         )
-    X_plot = x_plot[:, np.newaxis]
 
-    X, Y = (x_plot + 5, model.predict(X_plot))
+    X, Y = (x_plot + 5, predict_polynomials(coefs, intercepts, x_plot[np.newaxis])[0])
                             
     return X, Y
\ No newline at end of file
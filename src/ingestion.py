@@ -0,0 +1,139 @@
+"""
+ingestion: Functions to stream the harmonised data
+=============================================
+
+.. moduleauthor:: Lilian MAREY <lilian.marey@ensae.fr>
+
+"""
+import pathlib
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.mysettings import HARMONISED_CHUNKSIZE, harmonised_columns, harmonised_dtypes
+
+
+def read_harmonised(path, countries = None, regions = None, sexes = None, ages = None, 
+                    excluded_countries = ['UK'], chunksize = HARMONISED_CHUNKSIZE):
+    """Reads the harmonised data by chunks, keeping the selected rows of each chunk
+
+    Parameters:
+    -----------
+    path : str or pathlib.Path
+        the harmonised data file (Output_10.csv)
+
+    countries, regions, sexes, ages : lists
+        the values to select (None for no selection)
+
+    excluded_countries : str list
+        the countries to delete (detected untrue sources)
+
+    chunksize : int
+        the number of rows of the file read at once
+
+    Returns
+    -----------
+        chunks : generator of Pandas DataFrame
+            the selected rows of each chunk
+    """
+    reader = pd.read_csv(
+                        path, 
+                        skiprows = [0, 1, 2], 
+                        usecols = harmonised_columns, 
+                        dtype = harmonised_dtypes,
+                        chunksize = chunksize
+                        )
+
+    for chunk in reader:
+        chunk = chunk[harmonised_columns]
+        chunk = chunk[~chunk['Country'].isin(excluded_countries)]
+
+        for col, selection in [('Country', countries), ('Region', regions), ('Sex', sexes), ('Age', ages)]:
+            if selection is not None:
+                chunk = chunk[chunk[col].isin(selection)]
+
+        yield chunk
+
+def spool_by_country(chunks, spool_path):
+    """Writes chunks into a temporary Parquet dataset with one directory by country,
+    so that the rows of a country can be read without the rest of the data
+
+    Parameters:
+    -----------
+    chunks : iterable of Pandas DataFrame
+        chunks of the harmonised data (see read_harmonised)
+
+    spool_path : str or pathlib.Path
+        the directory of the temporary dataset
+
+    Returns
+    -----------
+        countries : str list
+            the countries of the spooled rows
+    """
+    countries = set()
+
+    for i, chunk in enumerate(chunks):
+        if chunk.empty:
+            continue
+
+        pq.write_to_dataset(
+                            pa.Table.from_pandas(chunk, preserve_index = False),
+                            root_path = str(spool_path),
+                            partition_cols = ['Country'],
+                            use_threads = False,
+                            basename_template = 'chunk-' + str(i) + '-{i}.parquet',
+                            existing_data_behavior = 'overwrite_or_ignore',
+                            )
+        countries.update(chunk['Country'].unique())
+
+    return sorted(countries)
+
+def read_spooled_country(spool_path, country):
+    """Reads the spooled rows of a country
+
+    Parameters:
+    -----------
+    spool_path : str or pathlib.Path
+        the directory of the temporary dataset (see spool_by_country)
+
+    country : str
+        the country to read
+
+    Returns
+    -----------
+        df : Pandas DataFrame
+            the harmonised data of the country
+    """
+    df = pd.read_parquet(
+                        str(spool_path), 
+                        engine = 'pyarrow', 
+                        filters = [('Country', '==', country)]
+                        )
+    df['Country'] = df['Country'].astype(object)
+
+    # ages are read as floats, missing values can only be held by floats
+    if df['Age'].notna().all():
+        df['Age'] = df['Age'].astype('int64')
+
+    return df[harmonised_columns].reset_index(drop = True)
+
+def spooled_countries(spool_path):
+    """Gives the countries of a spooled dataset
+
+    Parameters:
+    -----------
+    spool_path : str or pathlib.Path
+        the directory of the temporary dataset (see spool_by_country)
+
+    Returns
+    -----------
+        countries : str list
+            the countries of the spooled rows
+    """
+    if not any(pathlib.Path(spool_path).iterdir()):
+        return []
+
+    df = pd.read_parquet(str(spool_path), engine = 'pyarrow', columns = ['Country'])
+
+    return sorted(df['Country'].astype(str).unique())
@@ -23,6 +23,60 @@ HARMONISED_DATA_PATH = DATA_PATH.joinpath('Output_10.csv')
 POPULATION_DATA_PATH = DATA_PATH.joinpath('./population_datasets/Countries_pop.csv')
 USSTATES_DATA_PATH = DATA_PATH.joinpath('./population_datasets/States_of_the_USA_pop.csv')
 
+# Preprocessed data : Parquet store read by the app (one directory by Country and Metric),
+# optional CSV export
+PREPROCESSED_DATA_PATH = DATA_PATH.joinpath('preprocessed_data.parquet')
+PREPROCESSED_CSV_PATH = DATA_PATH.joinpath('preprocessed_data.csv')
+# Hashes of the processed series, used to only process changed series
+PREPROCESSED_MANIFEST_PATH = DATA_PATH.joinpath('preprocessed_manifest.parquet')
+# Series table : integer key (series_id) of each series, with its Country, Region, Age, Sex and label
+PREPROCESSED_SERIES_PATH = DATA_PATH.joinpath('preprocessed_series.parquet')
+# Version of the preprocessed data, written again each time it changes : the app only watches this file
+PREPROCESSED_VERSION_PATH = DATA_PATH.joinpath('preprocessed_version.txt')
+# Outputs of the stages of the processing, used to resume an interrupted processing
+CHECKPOINTS_PATH = DATA_PATH.joinpath('checkpoints')
+# Checkpoints unused for longer (seconds) are deleted at the end of a processing (see --prune)
+CHECKPOINTS_MAX_AGE = 7 * 24 * 3600
+
+# Countries served by the app (None for all the countries of the preprocessed data)
+SERVED_COUNTRIES = None
+# Number of trend curves kept in cache by the app (least recently used ones are evicted)
+TREND_CACHE_SIZE = 1000
+# Total size (bytes of JSON) of the figures kept in cache by the app
+FIGURE_CACHE_SIZE = 64 * 2 ** 20
+# Downloaded data : number of rows serialised at once
+EXPORT_CHUNKSIZE = 100000
+# Charts : number of points above which WebGL is used instead of SVG, and downsampling of the
+# series having more points than the width of the chart (pixels), keeping their peaks
+SCATTER_WEBGL_THRESHOLD = 1000
+DOWNSAMPLE_SERIES = True
+# Data table : number of rows of a page, and displayed columns (column of the data, name)
+TABLE_PAGE_SIZE = 50
+table_columns = [
+    ('Date_format', 'Date'),
+    ('Metric', 'Metric'),
+    ('Value', 'Value'),
+    ('Country', 'Country'),
+    ('Region', 'Region'),
+    ('Age', 'Age'),
+    ('Sex', 'Gender'),
+]
+
+# Harmonised data : number of rows read at once, columns used and their types
+# (the same for every chunk : the spooled chunks must share one schema)
+HARMONISED_CHUNKSIZE = 500000
+harmonised_columns = ['Country', 'Region', 'Date', 'Sex', 'Age', 'Cases', 'Deaths', 'Tests']
+harmonised_dtypes = {
+    'Country' : str,
+    'Region' : str,
+    'Date' : str,
+    'Sex' : str,
+    'Age' : float,
+    'Cases' : float,
+    'Deaths' : float,
+    'Tests' : float
+                    }
+
 #dictionary for genders label
 label_gender = {
     'b' : 'Both sexes',
@@ -30,6 +84,12 @@ label_gender = {
     'f' : 'Females'
                 }
 
+#dictionary for corrections of the regions names, to fit with other datasets (population, maps)
+region_corrections = {
+    'Lousiana' : 'Louisiana',
+    'NYC' : 'New York'
+                }
+
 #dictionary for codes of the US states
 code_state = {
     'Alabama': 'AL',
@@ -360,6 +420,31 @@ label_dic = {
     'Biweekly Tests' : 'Number of Biweekly tests',
             }
 
+# storage types of the columns of the preprocessed data
+label_columns = [
+                'Country',
+                'Region',
+                'Sex',
+                'Metric',
+                'Date',
+                'Date_format'
+                ]
+# smallest types holding the values (ages < 32768 and days since first_day < 32768,
+# Date_code YYYYMMDD < 2**31)
+integer_columns = {
+                'series_id' : 'int32',
+                'Age' : 'int16',
+                'Date_code' : 'int32',
+                'gap_in_day' : 'int16'
+                    }
+partition_columns = ['Country', 'Metric']
+float_columns = ['Value', 'Value_by_pop']
+# 'float32' halves the memory of the values, keeping about 7 significant digits
+FLOAT_DTYPE = 'float64'
+
+# day from which gap_in_day values are counted
+first_day = '2020-01-01'
+
 # months code for x axis labels
 months_list = [
                 'Jan',
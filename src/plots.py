@@ -12,14 +12,18 @@ import plotly.graph_objects as go
 import plotly.express as px
 
 from src.mysettings import label_dic, months_list, code_state, code_country, firsts_of_the_month
-from src.helpers import select_data, regions_of_country, dfadaptDateRange,computeDateFormat, regression, computeDatecode, adaptDataframeHistogram, ageRange, regression_histogram
+from src.mysettings import SCATTER_WEBGL_THRESHOLD
+from src.helpers import select_data, regions_of_country, dfadaptDateRange, select_date_range, computeDateFormat, regression, computeDatecode, adaptDataframeHistogram, ageRanges, regression_histogram
+from src.helpers import seriesLabels, attachLabels, series_slices, latest_value_index, latest_values
+from src.helpers import series_offsets, lttb_rows
 from src.preprocess import divide_US_Dataframe
 
 
 
 def plot_metrics(df, countries_list, regions_list, ages_list, genders_list, 
                 metrics, logvalue, start_date, end_date, rug_value, 
-                reverse, trend, forecast, unit, table_option
+                reverse, trend, forecast, unit, series = None,
+                trend_cache = None, downsample = False, index = None
                 ):
     """Plotting several metrics (e.g cases, deaths or tests) depending on criteria (parameters)
 
@@ -66,9 +70,20 @@ def plot_metrics(df, countries_list, regions_list, ages_list, genders_list,
 
     unit : str
         unit used to divide data
-    
-    table_option : bool
-        activates the table displaying option
+
+    series : Pandas DataFrame
+        the series table, giving the labels of the series (by default : built from df)
+
+    trend_cache : src.cache.LRUCache
+        the cache of the trend curves (see src.helpers.regression, None for no cache)
+
+    downsample : bool
+        downsamples the series having more points than the width of the chart,
+        keeping their peaks (see src.helpers.lttb_rows)
+
+    index : dict
+        the date ranges lookup of df (see src.helpers.date_range_index, None to compare
+        each row to the selection)
 
     Returns:
     --------
@@ -81,19 +96,30 @@ def plot_metrics(df, countries_list, regions_list, ages_list, genders_list,
     else:
         df0 = df
 
-    df0 = select_data(
-                        df, 
-                        countries_list, 
-                        regions_list, 
-                        ages_list, 
-                        genders_list
-                    )
-    
-    df0 = dfadaptDateRange(df0, start_date, end_date)
-    df0 = df0[df0['Metric'].isin(metrics)]
+    if index is not None:
+        df0 = select_date_range(
+                                df, 
+                                index, 
+                                countries_list, 
+                                regions_list, 
+                                ages_list, 
+                                genders_list, 
+                                metrics, 
+                                start_date, 
+                                end_date
+                                )
+    else:
+        df0 = select_data(
+                            df, 
+                            countries_list, 
+                            regions_list, 
+                            ages_list, 
+                            genders_list
+                        )
+        
+        df0 = dfadaptDateRange(df0, start_date, end_date)
+        df0 = df0[df0['Metric'].isin(metrics)]
 
-    df0[['Date_format', 'Metric', 'Value', 'Country', 'Region', 'Age', 'Sex']].to_csv('data/download/data_download.csv')
-    
     if df0.empty:
         fig = go.Figure(
                     go.Indicator(
@@ -105,49 +131,54 @@ def plot_metrics(df, countries_list, regions_list, ages_list, genders_list,
 
         return fig
 
-    elif table_option:
-        fig = go.Figure(data=
-                            [
-                                go.Table(header = dict( 
-                                                        values = list(['Date', 'Metric', 'Value', 'Country', 'Region', 'Age', 'Gender']),
-                                                        fill_color = 'rgba(0,131,138,0.5)',
-                                                    ),
-                                        cells = dict(
-                                                    values=[df0.Date_format, df0.Metric, df0.Value, df0.Country, df0.Region, df0.Age, df0.Sex],
-                                                    fill_color = 'white',
-                                                    )
-                                        )
-                            ]
-                        ) 
-
-        fig.update_layout(autosize=False,
-                        width= 1425,
-                        height=710,
-                        )
-
-        return fig
-
     else:
         pass
 
+    # labels of the legend, only for the plotted series
+    # (a dataset without series table may hold its labels, built with the original regions)
+    if series is None and 'Country - Region - Age - Gender' in df0.columns:
+        series = df0[['series_id', 'Country - Region - Age - Gender']].drop_duplicates('series_id')
+        series = series.rename(columns = {'Country - Region - Age - Gender' : 'label'})
+    elif series is None:
+        series = df0[['series_id', 'Country', 'Region', 'Age', 'Sex']].drop_duplicates('series_id')
+        series['label'] = seriesLabels(series)
+
+    df0 = attachLabels(df0, series)
+
     if unit ==  'Per million inhabitants' and regions_list == ['All']:
         unit_tag = ' (Per million inhabitants)'
-        Y = df0['Value_by_pop']
+        value_column = 'Value_by_pop'
     else:
         unit_tag = ''
-        Y = df0['Value']
+        value_column = 'Value'
+
+    # width of the chart (pixels) : the series with more points are downsampled
+    width = 1425
+    df_plot = df0
+
+    if downsample:
+        offsets = series_offsets(df0)
+        rows = lttb_rows(
+                        df0['gap_in_day'].to_numpy(dtype = float),
+                        df0[value_column].to_numpy(dtype = float),
+                        (offsets['stop'] - offsets['start']).to_numpy(),
+                        width
+                        )
+        df_plot = df0.iloc[rows]
+
+    Y = df_plot[value_column]
 
     if reverse:
-        X,Y = Y, df0['gap_in_day']
+        X,Y = Y, df_plot['gap_in_day']
     else:
-        X,Y =  df0['gap_in_day'], Y
+        X,Y =  df_plot['gap_in_day'], Y
 
     if regions_list == ['All']:
         region_tag = ''
     else:
         region_tag = ' (Regions)'
 
-    fig = px.scatter(df0, 
+    fig = px.scatter(df_plot, 
                     x = X,
                     y = Y,
                     log_y = logvalue, 
@@ -172,6 +203,8 @@ def plot_metrics(df, countries_list, regions_list, ages_list, genders_list,
                     title = 'COVID-19 : ' +  ', '.join(metrics) + ' in '+  ', '.join(countries_list) + region_tag,
                     marginal_y = rug_value,
                     template = 'plotly_white',
+                    # WebGL for the dense charts
+                    render_mode = 'webgl' if len(df_plot) > SCATTER_WEBGL_THRESHOLD else 'svg',
                     )
 
     fig.update_traces(marker = dict(
@@ -186,7 +219,7 @@ def plot_metrics(df, countries_list, regions_list, ages_list, genders_list,
     
     fig.update_layout(
                     autosize = False,
-                    width = 1425,
+                    width = width,
                     height = 710,
                     )
 
@@ -242,7 +275,7 @@ def plot_metrics(df, countries_list, regions_list, ages_list, genders_list,
                         )
 
     if trend>0:
-        reg = regression(df0, trend, forecast, unit ==  'Per million inhabitants')
+        reg = regression(df0, trend, forecast, unit ==  'Per million inhabitants', cache = trend_cache)
 
         for X, Y in reg:
 
@@ -270,8 +303,40 @@ def plot_metrics(df, countries_list, regions_list, ages_list, genders_list,
 
     return fig
 
+def histogram_data(df, country, region, gender, metric, end_date):
+    """Selects the data of the histogram by age ranges : the latest row of each age range
+
+    Parameters:
+    -----------
+    df : Pandas DataFrame
+        the original dataset
+
+    country, region, gender, metric : str
+        the selected country, region, gender and metric
+
+    end_date : int
+        gap_in_day value of the last date to consider
+
+    Returns:
+    --------
+        df : Pandas DataFrame
+            the corresponding data
+    """
+    df0 = select_data(
+                        df, 
+                        [country], 
+                        [region], 
+                        [i*10 for i in range(11)], 
+                        [gender]
+                    )
+    
+    df0 = df0[df0['Metric'] == metric]
+    df0 = adaptDataframeHistogram(df0, end_date)
+
+    return df0
+
 def plot_histogram(df, country, region, gender, metric, 
-                    logvalue, trend, table_option, end_date
+                    logvalue, trend, end_date
                 ):
     """Plotting histogram by age ranges depending on criteria (parameters)
 
@@ -297,9 +362,6 @@ def plot_histogram(df, country, region, gender, metric,
 
     trend : int
         the degree of the polynom we want to modelize
-    
-    table_option : bool
-        activates the table displaying option
 
     end_date : int
         gap_in_day value of the last date to consider
@@ -309,17 +371,7 @@ def plot_histogram(df, country, region, gender, metric,
         fig : plotly Figure
             the corresponding plot
     """
-    df0 = df.copy()
-    df0 = select_data(
-                        df, 
-                        [country], 
-                        [region], 
-                        [i*10 for i in range(11)], 
-                        [gender]
-                    )
-    
-    df0 = df0[df0['Metric'] == metric]
-    df0 = adaptDataframeHistogram(df0, end_date)
+    df0 = histogram_data(df, country, region, gender, metric, end_date)
 
     if df0.empty:
         fig = go.Figure(
@@ -331,28 +383,6 @@ def plot_histogram(df, country, region, gender, metric,
 
         return fig
 
-    elif table_option:
-        fig = go.Figure(data=
-                            [
-                                go.Table(header = dict( 
-                                                        values = list(['Date', 'Metric', 'Value', 'Country', 'Region', 'Age', 'Gender']),
-                                                        fill_color = 'rgba(0,131,138,0.5)',
-                                                    ),
-                                        cells = dict(
-                                                    values=[df0.Date_format, df0.Metric, df0.Value, df0.Country, df0.Region, df0.Age, df0.Sex],
-                                                    fill_color = 'white',
-                                                    )
-                                        )
-                            ]
-                        ) 
-        fig.update_layout(
-                        autosize=False,
-                        width= 1425,
-                        height=710,
-                        )
-
-        return fig
-
     else:
         if region == 'All':
             region_tag = ''
@@ -360,8 +390,7 @@ def plot_histogram(df, country, region, gender, metric,
         else:
             region_tag = region + ', '
 
-        df0['Age range'] = df0.apply(ageRange, axis = 1)
-        df0.sort_values(by = ['Date_code'], ascending=False)
+        df0['Age range'] = ageRanges(df0['Age'])
 
         fig = px.histogram(
                             df0, 
@@ -428,7 +457,7 @@ def plot_histogram(df, country, region, gender, metric,
         return fig
 
 
-def plot_usa_map(df, age, gender, metric, selected_unit, end_date):
+def plot_usa_map(df, age, gender, metric, selected_unit, end_date, index = None):
     """Plotting choropleth map of the USA depending on criteria (parameters)
 
     Parameters:
@@ -451,57 +480,27 @@ def plot_usa_map(df, age, gender, metric, selected_unit, end_date):
     end_date : str 
         the last date to be considered
 
+    index : dict
+        the latest value lookup of the dataset (computed if not given, see latest_value_index)
+
     Returns:
     --------
         fig : plotly Figure
             the corresponding plot
     """
     States = regions_of_country(df,['USA'])
-    df0 = select_data(
-                        df, 
-                        ['USA'], 
-                        States, 
-                        [age], 
-                        [gender]
-                    )
 
-    df0['Date_code'] = df0.apply(computeDatecode, axis = 1)
-    df0['Date_format'] = df0.apply(computeDateFormat, axis = 1)
-    df0 = df0.sort_values(by = ['Date_code'])
+    if index is None:
+        index = latest_value_index(df)
 
-    df0 = df0[df0['Metric'] == metric]
-    df0 = df0[df0['gap_in_day'] <= end_date]
+    # the latest known value of each state (age, gender and metric are fixed)
+    df1 = latest_values(index, metric, age, gender, end_date, countries = ['USA'], regions = States)
+    df1 = divide_US_Dataframe(df1, selected_unit)
 
-    values_list = []
-    dates_list = []
+    states_values = dict(zip(df1['Region'], zip(df1['Value'], df1['Date_format'])))
 
-    for state in States:
-        df1 = select_data(
-                            df0, 
-                            ['USA'], 
-                            [state], 
-                            [age], 
-                            [gender]
-                        )
-
-        df1 = divide_US_Dataframe(df1, selected_unit)
-
-        if len(df1) == 0:
-            values_list.append('nan')
-            dates_list.append('nan')
-
-        else:
-            index = len(df1) - 1
-            value = list(df1['Value'])[index]
-            date = list(df1['Date_format'])[index]
-
-            while isnan(value) and index > 0:
-                index -= 1
-                value = list(df1['Value'])[index]
-                date = list(df1['Date_format'])[index]
-
-            values_list.append(value)
-            dates_list.append(date)
+    values_list = [states_values.get(state, ('nan', 'nan'))[0] for state in States]
+    dates_list = [states_values.get(state, ('nan', 'nan'))[1] for state in States]
 
     Code = [code_state[state] for state in States]
 
@@ -553,7 +552,7 @@ def plot_usa_map(df, age, gender, metric, selected_unit, end_date):
 
     return fig
 
-def plot_world_map(df, age, gender, metric, selected_unit, end_date):
+def plot_world_map(df, age, gender, metric, selected_unit, end_date, index = None):
     """Plotting choropleth world map depending on criteria (parameters)
 
     Parameters:
@@ -576,6 +575,9 @@ def plot_world_map(df, age, gender, metric, selected_unit, end_date):
     end_date : str 
         the last date to be considered
 
+    index : dict
+        the latest value lookup of the dataset (computed if not given, see latest_value_index)
+
     Returns:
     --------
         fig : plotly Figure
@@ -595,51 +597,21 @@ def plot_world_map(df, age, gender, metric, selected_unit, end_date):
         except ValueError:
             pass
 
-    df0 = select_data(
-                        df, 
-                        Countries, 
-                        ['All'], 
-                        [age], 
-                        [gender]
-                    )
-    df0['Date_code'] = df0.apply(computeDatecode, axis = 1)
-    df0 = df0.sort_values(by = ['Date_code'])
-    df0['Date_format'] = df0.apply(computeDateFormat, axis = 1)
-    df0 = df0[df0['Metric'] == metric]
-    df0 = df0[df0['gap_in_day'] <= end_date]
+    if index is None:
+        index = latest_value_index(df)
 
-    values_list = []
-    dates_list = []
-    
-    for country in Countries:
-        df1 = select_data(
-                            df0, 
-                            [country], 
-                            ['All'], 
-                            [age], 
-                            [gender]
-                        )
-
-        if selected_unit == 'Per million inhabitants':
-            column = 'Value_by_pop'
-        else:
-            column = 'Value'
+    if selected_unit == 'Per million inhabitants':
+        column = 'Value_by_pop'
+    else:
+        column = 'Value'
 
-        if len(df1) == 0:
-            values_list.append('nan')
-            dates_list.append('nan')
-        else:
-            index = len(df1)-1
-            value = list(df1[column])[index]
-            date = list(df1['Date_format'])[index]
+    # the latest known value of each country (region, age, gender and metric are fixed)
+    df1 = latest_values(index, metric, age, gender, end_date, column, countries = Countries, regions = ['All'])
 
-            while isnan(value) and index > 0:
-                index -= 1
-                value = list(df1[column])[index]
-                date = list(df1['Date_format'])[index]
+    countries_values = dict(zip(df1['Country'], zip(df1['Value'], df1['Date_format'])))
 
-            values_list.append(value)
-            dates_list.append(date)
+    values_list = [countries_values.get(country, ('nan', 'nan'))[0] for country in Countries]
+    dates_list = [countries_values.get(country, ('nan', 'nan'))[1] for country in Countries]
 
     Code = [code_country[country] for country in Countries]
     df2 = pd.DataFrame(
@@ -685,31 +657,65 @@ def plot_world_map(df, age, gender, metric, selected_unit, end_date):
     return fig
 
 def build_download_file(df, countries_list, regions_list, ages_list, genders_list, 
-                metrics, start_date, end_date
+                metrics, start_date, end_date, index = None
                 ):
+    """Builds the data downloaded with a chart (see plot_metrics)
+
+    Parameters:
+    -----------
+    df : Pandas DataFrame
+        the original dataset
+
+    countries_list, regions_list, ages_list, genders_list : lists
+        the countries, regions, age ranges and genders to select
+
+    metrics : str list
+        the metrics to select
+
+    start_date, end_date : str
+        the first and last dates to be considered
 
+    index : dict
+        the date ranges lookup of df (see src.helpers.date_range_index, None to compare
+        each row to the selection)
 
+    Returns:
+    --------
+        df : Pandas DataFrame
+            the corresponding data
+    """
     if 'All' in regions_list and ('UK' in countries_list) :
             # df0 = delete_multiple_sources(df, ages_list, genders_list)
             df0 = df
     else:
         df0 = df
 
-    df0 = select_data(
-                        df, 
-                        countries_list, 
-                        regions_list, 
-                        ages_list, 
-                        genders_list
-                    )
-    
-    df0 = dfadaptDateRange(df0, start_date, end_date)
-    df0 = df0[df0['Metric'].isin(metrics)]
+    if index is not None:
+        df0 = select_date_range(
+                                df, 
+                                index, 
+                                countries_list, 
+                                regions_list, 
+                                ages_list, 
+                                genders_list, 
+                                metrics, 
+                                start_date, 
+                                end_date
+                                )
+    else:
+        df0 = select_data(
+                            df, 
+                            countries_list, 
+                            regions_list, 
+                            ages_list, 
+                            genders_list
+                        )
+        
+        df0 = dfadaptDateRange(df0, start_date, end_date)
+        df0 = df0[df0['Metric'].isin(metrics)]
     
     df0 = df0[['Date_format', 'Metric', 'Value', 'Country', 'Region', 'Age', 'Sex']]
 
-    print(df0.head())
-
     # elif table_option:
     #     fig = go.Figure(data=
     #                         [
@@ -730,4 +736,4 @@ def build_download_file(df, countries_list, regions_list, ages_list, genders_lis
         #                 height=710,
         #                 )
 
-    return None
\ No newline at end of file
+    return df0
\ No newline at end of file
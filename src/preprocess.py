@@ -5,51 +5,114 @@ app: Module to run the app
 .. moduleauthor:: Lilian MAREY <lilian.marey@ensae.fr>
 
 """
+import numpy as np
 import pandas as pd
+from functools import lru_cache
 
 # global settings
 from src.mysettings import *
 
-# helper functions
-from src.helpers import delete_spaces
+###################################
+# Functions
 
+def populationIndex(pop_df, key):
+    """Builds a population index, parsing and cleaning population figures once
 
-##########################################
-# Load in memory needed data :
-# Harmonised data on cases, deaths, tests
-# Population data (worldwide)
-# US states population
+    Parameters:
+    -----------
+    pop_df : Pandas DataFrame
+        population dataset, with a 'pop' column
 
-print('Importation of population datasets...')
-pop_by_country = pd.read_csv(POPULATION_DATA_PATH, sep = ';')
-pop_usa_states =  pd.read_csv(USSTATES_DATA_PATH, sep = ';')
-print('Done')
+    key : str
+        the column with the names of the countries or states
 
-###################################
-# Functions
+    Returns:
+    --------
+        index : Pandas Series
+            the population (float) indexed by country or state name
+    """
+    pop = pop_df['pop']
 
-def computeValuebyPop(row):
-    """Computes values divided by the coountry population
+    if pop.dtype == object:
+        # figures like '4 903 185'
+        pop = pop.astype(str).str.replace(' ', '', regex = False)
+
+    index = pd.Series(
+                    pd.to_numeric(pop, errors = 'coerce').to_numpy(dtype = float),
+                    index = pop_df[key].astype(str).str.strip()
+                    )
+    index = index[~index.index.duplicated(keep = 'first')]
+
+    return index
+
+@lru_cache(maxsize = 1)
+def population_indexes():
+    """Loads the population data (worldwide and US states) and builds their indexes,
+    once, when they are first needed (importing the module does not read them)
+
+    Returns:
+    --------
+        pop_index_country : Pandas Series
+            the population indexed by country name (see populationIndex)
+
+        pop_index_state : Pandas Series
+            the population indexed by US state name
+    """
+    print('Importation of population datasets...')
+    pop_by_country = pd.read_csv(POPULATION_DATA_PATH, sep = ';')
+    pop_usa_states =  pd.read_csv(USSTATES_DATA_PATH, sep = ';')
+    print('Done')
+
+    return populationIndex(pop_by_country, 'Country'), populationIndex(pop_usa_states, 'State')
+
+def divideByPop(values, pop):
+    """Divides values by populations, by millions of inhabitants
+
+    Parameters:
+    -----------
+    values : numpy array
+        the original values
+
+    pop : numpy array
+        the corresponding populations (NaN if unknown)
+
+    Returns:
+    --------
+        values : numpy array
+            the values by millions of inhabitants, truncated to 2 decimals
+            (NaN for unknown populations)
+    """
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        values = np.trunc(100 * 1000000 * values / pop) / 100
+
+    values[np.isinf(values)] = np.nan
+
+    return values
+
+def computeValuesbyPop(df):
+    """Computes values divided by the population of the country,
+    or of the state for the regions of the USA
 
     Parameters:
     -----------
-    row : Pandas Serie
-        row of a DataFrame
-       
+    df : Pandas DataFrame
+        dataset (long format, with 'Value' column)
+
     Returns:
     --------
-        Val : float
-            the corresponding value (original value by millions of inhabitants)
+        values : Pandas Series
+            the corresponding values (original value by millions of inhabitants),
+            NaN where the population is unknown
     """
-    try:
-        Val = int(
-                100 * 1000000 * row.Value 
-                / pop_by_country[pop_by_country['Country'] == row.Country]['pop'].values[0]
-                ) / 100
-    except OverflowError:
-        Val = None
+    pop_index_country, pop_index_state = population_indexes()
+    pop = df['Country'].map(pop_index_country).to_numpy(dtype = float)
+
+    states = (df['Country'] == 'USA').to_numpy() & (df['Region'] != 'All').to_numpy()
+    pop[states] = df.loc[states, 'Region'].map(pop_index_state).to_numpy(dtype = float)
+
+    values = divideByPop(df['Value'].to_numpy(dtype = float), pop)
 
-    return Val
+    return pd.Series(values, index = df.index)
 
 def divide_US_Dataframe(df, unit):
     """Divides values of metrics of the US dataframe by a certain unit
@@ -68,15 +131,10 @@ def divide_US_Dataframe(df, unit):
             The coresponding dataframe (long format, melted)
     """
     if unit == 'Per million inhabitants':
-        df['Value'] = df.apply(
-                                lambda row:  int( 100 * 1000000 * row['Value']
-                                                / int(
-                                                        delete_spaces(
-                                                            pop_usa_states[pop_usa_states['State'] == row.Region]['pop'].values[0]
-                                                                    )
-                                                    )
-                                                ) / 100, 
-                                axis = 1
+        pop_index_country, pop_index_state = population_indexes()
+        df['Value'] = divideByPop(
+                                df['Value'].to_numpy(dtype = float),
+                                df['Region'].map(pop_index_state).to_numpy(dtype = float)
                                 )
     else:
         pass
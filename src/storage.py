@@ -0,0 +1,467 @@
+"""
+storage: Functions to write and read the preprocessed dataset
+=============================================
+
+.. moduleauthor:: Lilian MAREY <lilian.marey@ensae.fr>
+
+"""
+import os
+import shutil
+import pathlib
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+
+from uuid import uuid4
+
+from src.mysettings import label_columns, integer_columns, float_columns, partition_columns, FLOAT_DTYPE
+from src.helpers import sort_series
+
+
+def apply_store_schema(df, float_dtype = FLOAT_DTYPE):
+    """Gives the columns of the preprocessed dataset their storage types :
+    categories (dictionary encoded) for labels, smallest integer types for codes,
+    floats for values. Columns which already have their type are not copied.
+
+    Parameters:
+    -----------
+    df : Pandas DataFrame
+        the preprocessed dataset
+
+    float_dtype : str
+        the type of the values ('float64' or 'float32')
+
+    Returns
+    -----------
+        df : Pandas DataFrame
+            the corresponding dataset
+    """
+    df = df.copy(deep = False)
+
+    for col in label_columns:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+
+    for col, dtype in integer_columns.items():
+        if col in df.columns and df[col].dtype != dtype:
+            df[col] = pd.to_numeric(df[col], errors = 'coerce')
+
+            # missing values (malformed dates) can only be held by floats
+            if df[col].notna().all():
+                df[col] = df[col].astype(dtype)
+
+    for col in float_columns:
+        if col in df.columns and df[col].dtype != float_dtype:
+            df[col] = pd.to_numeric(df[col], errors = 'coerce').astype(float_dtype)
+
+    return df
+
+def memory_report(df_before, df_after):
+    """Compares the memory footprint of two versions of a dataset, column by column
+
+    Parameters:
+    -----------
+    df_before, df_after : Pandas DataFrame
+        the dataset before and after a change of types (see apply_store_schema)
+
+    Returns
+    -----------
+        report : Pandas DataFrame
+            the types and sizes (MB) of the columns before and after, with a Total row
+    """
+    def footprint(df):
+        return df.memory_usage(index = False, deep = True) / 1e6
+
+    report = pd.DataFrame({
+                        'dtype before' : df_before.dtypes.astype(str),
+                        'MB before' : footprint(df_before),
+                        'dtype after' : df_after.dtypes.astype(str),
+                        'MB after' : footprint(df_after),
+                            })
+    report.loc['Total'] = ['', report['MB before'].sum(), '', report['MB after'].sum()]
+
+    return report.round(2)
+
+def clear_store(path):
+    """Deletes the preprocessed dataset
+
+    Parameters:
+    -----------
+    path : str or pathlib.Path
+        the dataset to delete (Parquet directory or file)
+    """
+    path = pathlib.Path(path)
+
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+
+def replace_store(new_path, path):
+    """Replaces the preprocessed dataset by a dataset built beside it : the dataset
+    is only missing between two renames, never while the new one is built
+
+    Parameters:
+    -----------
+    new_path : str or pathlib.Path
+        the new dataset (Parquet directory or file), moved to path
+
+    path : str or pathlib.Path
+        the dataset to replace
+    """
+    path = pathlib.Path(path)
+    old_path = path.with_name(path.name + '-old-' + uuid4().hex)
+
+    if path.exists():
+        os.replace(path, old_path)
+
+    os.replace(new_path, path)
+    clear_store(old_path)
+
+def write_store(df, path, float_dtype = FLOAT_DTYPE):
+    """Writes the preprocessed dataset as a compressed Parquet dataset,
+    partitioned by Country and Metric (one directory by partition).
+    The rows are sorted by series, metric and date (see src.helpers.sort_series).
+
+    Parameters:
+    -----------
+    df : Pandas DataFrame
+        the preprocessed dataset
+
+    path : str or pathlib.Path
+        the directory to write (replaced if it exists)
+
+    float_dtype : str
+        the type of the values ('float64' or 'float32')
+    """
+    df = apply_store_schema(sort_series(df).reset_index(drop = True), float_dtype = float_dtype)
+    clear_store(path)
+
+    pq.write_to_dataset(
+                        pa.Table.from_pandas(df, preserve_index = False),
+                        root_path = str(path),
+                        partition_cols = partition_columns,
+                        compression = 'zstd',
+                        # the rows of a partition keep their order (sorted by date)
+                        use_threads = False,
+                        )
+
+def update_store(df, replaced_series, path, replaced_metrics = None, float_dtype = FLOAT_DTYPE):
+    """Replaces series of the Parquet dataset by newly processed ones.
+    Only the partitions of the countries of the new series are rewritten.
+
+    Parameters:
+    -----------
+    df : Pandas DataFrame
+        the newly processed series
+
+    replaced_series : int list
+        the series_id of the series to replace
+
+    path : str or pathlib.Path
+        the Parquet dataset to update
+
+    replaced_metrics : str list
+        the metrics of the series to replace (None for all)
+
+    float_dtype : str
+        the type of the values ('float64' or 'float32')
+    """
+    countries = sorted(set(df['Country'].astype(str)))
+
+    if len(countries) == 0:
+        return
+
+    if pathlib.Path(path).is_dir():
+        dataset = ds.dataset(str(path), format = 'parquet', partitioning = 'hive')
+        fragments = list(
+                        dataset.get_fragments(
+                                            filter = ds.field('Country').isin(countries)
+                                            )
+                        )
+
+        df_old = read_store(path, countries = countries)
+        replaced = df_old['series_id'].isin(replaced_series)
+
+        if replaced_metrics is not None:
+            replaced = replaced & df_old['Metric'].astype(str).isin(replaced_metrics)
+
+        df_old = df_old[~replaced]
+
+        if not df_old.empty:
+            df = pd.concat([df_old, df], ignore_index = True)
+
+    else:
+        fragments = []
+
+    df = apply_store_schema(sort_series(df), float_dtype = float_dtype)
+    basename = uuid4().hex
+
+    # the new files are written beside the old ones, which are only deleted once
+    # the write succeeded : a failed update leaves the dataset as it was
+    try:
+        pq.write_to_dataset(
+                            pa.Table.from_pandas(df, preserve_index = False),
+                            root_path = str(path),
+                            partition_cols = partition_columns,
+                            compression = 'zstd',
+                            # the rows of a partition keep their order (sorted by date)
+                            use_threads = False,
+                            basename_template = basename + '-{i}.parquet',
+                            existing_data_behavior = 'overwrite_or_ignore',
+                            )
+
+    except BaseException:
+        for file in pathlib.Path(path).rglob(basename + '-*.parquet'):
+            file.unlink()
+        raise
+
+    for fragment in fragments:
+        pathlib.Path(fragment.path).unlink()
+
+def read_manifest(path):
+    """Reads the manifest of the series of the preprocessed dataset
+
+    Parameters:
+    -----------
+    path : str or pathlib.Path
+        the manifest file
+
+    Returns
+    -----------
+        manifest : Pandas DataFrame
+            the manifest (None if there is no manifest)
+    """
+    if not pathlib.Path(path).exists():
+        return None
+
+    return pd.read_parquet(path, engine = 'pyarrow')
+
+def write_manifest(manifest, path, update = False):
+    """Writes the manifest of the series of the preprocessed dataset
+
+    Parameters:
+    -----------
+    manifest : Pandas DataFrame
+        the manifest of the processed series
+
+    path : str or pathlib.Path
+        the manifest file
+
+    update : bool
+        if true, keeps the series of the previous manifest which are not in the new one
+    """
+    old_manifest = read_manifest(path) if update else None
+
+    if old_manifest is not None:
+        label = 'Country - Region - Age - Gender'
+        old_manifest = old_manifest[~old_manifest[label].isin(manifest[label])]
+        manifest = pd.concat([old_manifest, manifest], ignore_index = True)
+
+    manifest.to_parquet(path, engine = 'pyarrow', index = False)
+
+def read_series(path):
+    """Reads the series table of the preprocessed dataset
+
+    Parameters:
+    -----------
+    path : str or pathlib.Path
+        the series table file
+
+    Returns
+    -----------
+        series : Pandas DataFrame
+            one row by series : its series_id, Country, Region, Age, Sex and label
+            (None if there is no series table)
+    """
+    if not pathlib.Path(path).exists():
+        return None
+
+    return pd.read_parquet(path, engine = 'pyarrow')
+
+def write_series(series, path):
+    """Writes the series table of the preprocessed dataset
+
+    Parameters:
+    -----------
+    series : Pandas DataFrame
+        the series table (see src.helpers.assignSeriesIds)
+
+    path : str or pathlib.Path
+        the series table file
+    """
+    series.to_parquet(path, engine = 'pyarrow', index = False)
+
+def read_store(path, countries = None, metrics = None, columns = None, float_dtype = FLOAT_DTYPE):
+    """Reads the preprocessed dataset from a Parquet dataset, or from a CSV file.
+    Only the partitions of the selected countries and metrics are read.
+    The storage types are applied (see apply_store_schema), and the rows of each
+    (series_id, Metric) are contiguous and sorted by date (see src.helpers.series_offsets).
+
+    Parameters:
+    -----------
+    path : str or pathlib.Path
+        the dataset to read (Parquet directory or file, or .csv file)
+
+    countries : str list
+        the countries to read (all by default)
+
+    metrics : str list
+        the metrics to read (all by default)
+
+    columns : str list
+        the columns to read (all by default)
+
+    float_dtype : str
+        the type of the values ('float64' or 'float32')
+
+    Returns
+    -----------
+        df : Pandas DataFrame
+            the preprocessed dataset
+    """
+    if str(path).endswith('.csv'):
+        # the columns identifying the series and ordering their rows are always read
+        label = 'Country - Region - Age - Gender'
+        needed = set(columns or []) | {label, 'Country', 'Region', 'Age', 'Sex', 'series_id', 'Metric', 'gap_in_day'}
+        df = pd.read_csv(path, usecols = None if columns is None else (lambda col : col in needed))
+        df = df.drop(columns = ['Unnamed: 0'], errors = 'ignore')
+
+        # CSV files written before the series table have no series_id : it is derived from
+        # the series of the whole file, so that it does not depend on the selection
+        # (the label holds the original region, the Region column the corrected one)
+        if 'series_id' not in df.columns:
+            keys = [label] if label in df.columns else ['Country', 'Region', 'Age', 'Sex']
+            df['series_id'] = df.groupby(keys, sort = True, dropna = False).ngroup()
+
+        if countries is not None:
+            df = df[df['Country'].isin(countries)]
+        if metrics is not None:
+            df = df[df['Metric'].isin(metrics)]
+
+        df = apply_store_schema(sort_series(df), float_dtype = float_dtype)
+
+        return df if columns is None else df[columns]
+
+    filters = []
+
+    if countries is not None:
+        filters.append(('Country', 'in', list(countries)))
+    if metrics is not None:
+        filters.append(('Metric', 'in', list(metrics)))
+
+    df = pd.read_parquet(
+                        path,
+                        engine = 'pyarrow',
+                        columns = columns,
+                        filters = filters if filters else None,
+                        )
+
+    return apply_store_schema(df, float_dtype = float_dtype)
+
+# comparisons of the filters of read_store_batches
+FILTER_FUNCTIONS = {
+    'in' : lambda col, value : col.isin(value),
+    '==' : lambda col, value : col == value,
+    '>=' : lambda col, value : col >= value,
+    '<=' : lambda col, value : col <= value,
+}
+
+def read_store_batches(path, filters = None, columns = None, batch_size = 100000, float_dtype = FLOAT_DTYPE):
+    """Reads the rows of the preprocessed dataset matching some filters, batch of rows
+    by batch of rows, so that the selection is never held in memory at once : only the
+    partitions (and row groups) which may match the filters are read (see read_store).
+
+    Parameters:
+    -----------
+    path : str or pathlib.Path
+        the dataset to read (Parquet directory or file, or .csv file)
+
+    filters : list of (column, operator, value) tuples
+        the conditions the rows match, all of them ('in', '==', '>=' or '<=')
+
+    columns : str list
+        the columns to read (all by default)
+
+    batch_size : int
+        the largest number of rows of a batch
+
+    float_dtype : str
+        the type of the values ('float64' or 'float32')
+
+    Returns
+    -----------
+        batches : generator of Pandas DataFrame
+            the matching rows, in the order of the dataset, with their storage types
+            (see apply_store_schema)
+    """
+    filters = filters or []
+
+    # no row matches an empty list (whose type pyarrow cannot infer)
+    if any(op == 'in' and len(value) == 0 for col, op, value in filters):
+        return
+
+    if str(path).endswith('.csv'):
+        needed = set(columns or []) | {col for col, op, value in filters}
+        chunks = pd.read_csv(
+                            path, 
+                            usecols = None if columns is None else (lambda col : col in needed), 
+                            chunksize = batch_size
+                            )
+
+        for df in chunks:
+            df = df.drop(columns = ['Unnamed: 0'], errors = 'ignore')
+
+            for col, op, value in filters:
+                df = df[FILTER_FUNCTIONS[op](df[col], value).to_numpy()]
+
+            df = apply_store_schema(df, float_dtype = float_dtype)
+
+            yield df if columns is None else df[columns]
+
+        return
+
+    dataset = ds.dataset(str(path), format = 'parquet', partitioning = 'hive')
+    batches = dataset.to_batches(
+                                columns = columns,
+                                filter = pq.filters_to_expression(filters) if filters else None,
+                                batch_size = batch_size
+                                )
+
+    for batch in batches:
+        if batch.num_rows:
+            yield apply_store_schema(batch.to_pandas(), float_dtype = float_dtype)
+
+def write_store_version(path):
+    """Writes a new version of the preprocessed dataset, after each write of the dataset
+    (see store_version) : the file is replaced at once, it is never read partially written
+
+    Parameters:
+    -----------
+    path : str or pathlib.Path
+        the version file
+    """
+    path = pathlib.Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    tmp_path.write_text(uuid4().hex)
+    os.replace(tmp_path, path)
+
+def store_version(path):
+    """Gives the version of the preprocessed dataset, without reading the dataset :
+    only the version file is read (see write_store_version)
+
+    Parameters:
+    -----------
+    path : str or pathlib.Path
+        the version file
+
+    Returns
+    -----------
+        version : str
+            the version of the dataset (None if there is no version file)
+    """
+    try:
+        return pathlib.Path(path).read_text()
+    except FileNotFoundError:
+        return None